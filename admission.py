@@ -0,0 +1,161 @@
+import multiprocessing
+import time
+
+# Controle de admissão: cada requisição ocupa uma vaga da sua classe enquanto é
+# atendida. Buscas pesadas ("expensive") têm menos vagas que o total de
+# atendentes, e a espera por uma vaga também prende um atendente, então vagas e
+# fila das buscas pesadas juntas deixam uma reserva livre para as consultas
+# pontuais ("cheap"). Com a classe e a fila cheias, ou passado queue_timeout, o
+# servidor responde 503 com Retry-After na hora. Uma conexão keep-alive ociosa
+# também prende um atendente, então ela conta como ocupada e é fechada quando
+# uma conexão nova precisa do atendente (ver Worker.wait_for_request).
+
+CLASSES = ("cheap", "expensive")
+# Routes that can scan large parts of a table; every other route is a point lookup
+EXPENSIVE_ROUTES = {"name", "exact-name", "cnpj-name", "batch-cpf"}
+DEFAULT_QUEUE_TIMEOUT = 1.0
+DEFAULT_RETRY_AFTER = 1
+# What each holder's connection is doing: answering requests (or none yet), waiting in accept()
+# for one (pool modes), idle between keep-alive requests, or idle and asked to close (process mode)
+ACTIVE, ACCEPTING, IDLE, RECLAIMED = range(4)
+
+def route_class(route):
+    return "expensive" if route in EXPENSIVE_ROUTES else "cheap"
+
+def reserved_workers(workers):
+    # Workers that expensive requests never hold, running or waiting: a quarter, at least one when there are two
+    return max(1, workers // 4) if workers > 1 else 0
+
+def default_expensive_slots(workers):
+    return max(1, workers // 2)
+
+def default_expensive_queue(workers, expensive_slots):
+    return max(0, workers - reserved_workers(workers) - expensive_slots)
+
+
+class Overloaded(Exception):
+    def __init__(self, request_class, retry_after):
+        super().__init__(f"Server busy: no capacity left for {request_class} requests")
+        self.request_class = request_class
+        self.retry_after = retry_after
+
+
+class AdmissionControl():
+    """
+    Vagas e filas por classe em memória compartilhada, válidas para todos os
+    processos do servidor. Cada processo atendente tem um índice ("holder"):
+    a vaga que ele ocupa (ou espera) fica registrada ali, e o servidor a
+    devolve com release_holder se o processo morrer no meio da requisição.
+    """
+
+    def __init__(self, workers, expensive_slots=None, queue_size=None, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 retry_after=DEFAULT_RETRY_AFTER):
+        expensive_slots = expensive_slots or default_expensive_slots(workers)
+        if queue_size is None:
+            queue_size = default_expensive_queue(workers, expensive_slots)
+        self.slots = {"cheap": workers, "expensive": expensive_slots}
+        # Requests allowed to wait for a slot, per class. Point lookups have a slot per
+        # worker, so they only wait if expensive ones hold workers beyond their share
+        self.queue_size = {"cheap": workers, "expensive": queue_size}
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._index = {name: i for i, name in enumerate(CLASSES)}
+        # Created before forking; the arrays are only touched while holding the condition's lock
+        self._condition = multiprocessing.Condition()
+        self._running = multiprocessing.Array('q', len(CLASSES), lock=False)
+        self._waiting = multiprocessing.Array('q', len(CLASSES), lock=False)
+        self._admitted = multiprocessing.Array('Q', len(CLASSES), lock=False)
+        self._rejected = multiprocessing.Array('Q', len(CLASSES), lock=False)
+        # Per holder (one per worker: a pool process, or a process-mode connection): class index + 1 of
+        # the slot it holds, or minus that while it waits for one; 0 when it has none
+        self._held = multiprocessing.Array('b', workers, lock=False)
+        self._state = multiprocessing.Array('b', workers, lock=False)
+
+    def acquire(self, request_class, holder=None):
+        """Take a slot of request_class, waiting up to queue_timeout. Raises Overloaded if none frees up."""
+        i = self._index[request_class]
+        slots = self.slots[request_class]
+        with self._condition:
+            if self._running[i] >= slots:
+                if self._waiting[i] >= self.queue_size[request_class]:
+                    self._rejected[i] += 1
+                    raise Overloaded(request_class, self.retry_after)
+                self._waiting[i] += 1
+                self._hold(holder, -(i + 1))
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._running[i] >= slots:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._rejected[i] += 1
+                            raise Overloaded(request_class, self.retry_after)
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting[i] -= 1
+                    self._hold(holder, 0)
+            self._running[i] += 1
+            self._admitted[i] += 1
+            self._hold(holder, i + 1)
+
+    def release(self, request_class, holder=None):
+        with self._condition:
+            self._running[self._index[request_class]] -= 1
+            self._hold(holder, 0)
+            self._condition.notify_all()
+
+    def release_holder(self, holder):
+        """
+        Give back the slot (or queue place) of a holder whose process died. Call
+        it once the process is gone and before its holder is reused.
+        """
+        with self._condition:
+            held = self._held[holder]
+            if held > 0:
+                self._running[held - 1] -= 1
+            elif held < 0:
+                self._waiting[-held - 1] -= 1
+            self._held[holder] = 0
+            self._state[holder] = ACTIVE
+            if held:
+                self._condition.notify_all()
+        return held != 0
+
+    def set_state(self, holder, state):
+        with self._condition:
+            self._state[holder] = state
+
+    def claim_idle(self, holder):
+        """
+        A pool worker idle on a keep-alive connection saw a connection waiting in the
+        shared accept queue. True if it should close the idle one and accept it:
+        no other worker is waiting in accept(). The holder then counts as accepting,
+        so the other idle workers leave their connections open.
+        """
+        with self._condition:
+            if ACCEPTING in self._state[:]:
+                return False
+            self._state[holder] = ACCEPTING
+            return True
+
+    def reclaim_idle(self):
+        """Process mode: ask one idle keep-alive connection to close. Returns its holder, or None."""
+        with self._condition:
+            for holder, state in enumerate(self._state):
+                if state == IDLE:
+                    self._state[holder] = RECLAIMED
+                    return holder
+        return None
+
+    def reclaimed(self, holder):
+        return self._state[holder] == RECLAIMED
+
+    def _hold(self, holder, value):
+        if holder is not None:
+            self._held[holder] = value
+
+    def snapshot(self):
+        with self._condition:
+            return {name: {"running": self._running[i], "waiting": self._waiting[i], "slots": self.slots[name],
+                           "queue_size": self.queue_size[name], "admitted": self._admitted[i],
+                           "rejected": self._rejected[i]}
+                    for name, i in self._index.items()}
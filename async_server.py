@@ -0,0 +1,206 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from datetime import datetime
+
+import cache
+import logs
+import parallel
+import server
+
+log = logging.getLogger("server.asyncio")
+
+
+class StreamSink():
+    """
+    Expõe um asyncio.StreamWriter com a interface bloqueante de socket
+    (send/sendall) usada pelas rotas do Worker. Só pode ser usado a partir
+    das threads do executor, nunca da thread do event loop.
+    """
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def sendall(self, data):
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def peer_closed(self):
+        # The event loop keeps reading the connection, so a client that went away
+        # shows up as a closing transport even while a query runs in the executor
+        return self.writer.transport.is_closing()
+
+
+class AsyncServer(server.Server):
+    """
+    Servidor baseado em asyncio.start_server com TLS nativo. Conexões ociosas
+    custam apenas uma corrotina; as consultas SQLite rodam num executor limitado,
+    cada thread com seu próprio Worker (e suas próprias conexões).
+    """
+
+    def __init__(self, host, port, cpf_db, cnpj_db, semaphore=None, workers=None,
+                 keepalive_timeout=server.KEEPALIVE_TIMEOUT, max_requests=server.MAX_KEEPALIVE_REQUESTS,
+                 cache_size=cache.DEFAULT_CACHE_SIZE, cache_ttl=cache.DEFAULT_CACHE_TTL, db_options=None,
+                 cpf_index_path=None, log_options=None, profile_options=None, query_timeout=None,
+                 admission_options=None, scan_partitions=None):
+        # The semaphore is unused here: the executor size bounds concurrency
+        super().__init__(host, port, cpf_db, cnpj_db, semaphore, workers=workers,
+                         keepalive_timeout=keepalive_timeout, max_requests=max_requests,
+                         cache_size=cache_size, cache_ttl=cache_ttl, db_options=db_options,
+                         cpf_index_path=cpf_index_path, log_options=log_options,
+                         profile_options=profile_options, query_timeout=query_timeout,
+                         admission_options=admission_options, scan_partitions=scan_partitions)
+        self.mode = "asyncio"
+        self.loop = None
+        self.executor = None
+        self._server = None
+        self._stopped = None
+        self._writers = set()
+        # Workers are dropped (and their connections closed) when the executor threads exit
+        self._local = threading.local()
+
+    def _worker(self):
+        # One Worker per executor thread: sqlite3 connections must stay on the thread that opened them
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            worker = self.create_worker()
+            worker.open()
+            self._local.worker = worker
+        return worker
+
+    def _dispatch(self, sink, request, keep_alive, queued_at):
+        # Time the request waited for a free executor thread
+        self.metrics.observe_wait(time.monotonic() - queued_at)
+        return self._worker().handle_request(sink, request, keep_alive)
+
+    @staticmethod
+    async def read_request(reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise server.BadRequest("Connection closed in the middle of a request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise server.BadRequest("Request headers too large")
+
+        request = server.Request.parse_head(head[:-4])
+        length = request.content_length
+        if length:
+            try:
+                request.body = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                raise server.BadRequest("Connection closed in the middle of a request")
+        return request
+
+    async def _handle_connection(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        ssl_object = writer.get_extra_info("ssl_object")
+        resumed = ssl_object is not None and ssl_object.session_reused
+        self.stats.increment("tls_handshakes_resumed" if resumed else "tls_handshakes_full")
+        log.debug("SSL handshake successful with %s (%s)", addr, "resumed" if resumed else "full")
+
+        self._writers.add(writer)
+        self.metrics.connection_opened()
+        sink = StreamSink(writer, self.loop)
+        handled = 0
+        try:
+            while handled < self.max_requests and self.running:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except server.BadRequest as e:
+                    log.info("Bad request from %s: %s", addr, e)
+                    await self.loop.run_in_executor(
+                        self.executor, self.send_http_json,
+                        sink, {"error": "Invalid request"}, "400 Bad Request"
+                    )
+                    break
+                if request is None:
+                    break
+
+                handled += 1
+                keep_alive = request.keep_alive and handled < self.max_requests
+                if not await self.loop.run_in_executor(self.executor, self._dispatch, sink, request, keep_alive,
+                                                       time.monotonic()):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            log.exception("Error handling client %s: %s", addr, e)
+        finally:
+            self._writers.discard(writer)
+            self.metrics.connection_closed()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+            log.debug("Connection with %s closed", addr)
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port,
+            ssl=self.ssl_context,
+            ssl_handshake_timeout=self.keepalive_timeout,
+            backlog=4096,
+            limit=server.MAX_HEADER_SIZE,
+            reuse_address=True,
+        )
+        self.metrics.listen_socket = self._server.sockets[0]
+        local_ip = self.get_local_ip()
+        log.info("Listening on %s:%s (HTTPS, asyncio, %d query threads)", local_ip, self.port, self.workers)
+
+        await self._stopped.wait()
+
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    def start(self):
+        logs.start(**self.log_options)
+
+        # Registrar o tempo de início
+        self.start_time = time.time()
+        start_datetime = datetime.fromtimestamp(self.start_time)
+        log.info("Starting at: %s", start_datetime.strftime('%Y-%m-%d %H:%M:%S'))
+
+        self.ssl_context = self.create_ssl_context()
+        self._start_cache()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self.loop = asyncio.new_event_loop()
+        self.running = True
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            log.exception("Error setting up server: %s", e)
+        finally:
+            self.running = False
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            parallel.shutdown()
+            self._stop_cache()
+            self.loop.close()
+
+    def stop(self):
+        self.running = False
+        if self.loop and self._stopped and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+        # Registrar o tempo de parada
+        self.stop_time = time.time()
+        stop_datetime = datetime.fromtimestamp(self.stop_time)
+        log.info("Stopped at: %s", stop_datetime.strftime('%Y-%m-%d %H:%M:%S'))
+        self._log_execution_time()
@@ -0,0 +1,165 @@
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import time
+import zlib
+
+import db
+import parallel
+import queries
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def print_summary(label, samples):
+    print(f"  {label:<16} p50={percentile(samples, 50) * 1000:8.3f}ms "
+          f"p90={percentile(samples, 90) * 1000:8.3f}ms "
+          f"p99={percentile(samples, 99) * 1000:8.3f}ms "
+          f"mean={sum(samples) / len(samples) * 1000:8.3f}ms")
+
+def sample_cpfs(cpf_db, quantity):
+    conn = sqlite3.connect(cpf_db)
+    try:
+        max_rowid = conn.execute("SELECT MAX(rowid) FROM cpf").fetchone()[0] or 0
+        rowids = [random.randint(1, max_rowid) for _ in range(quantity)]
+        cpfs = []
+        for rowid in rowids:
+            row = conn.execute("SELECT cpf FROM cpf WHERE rowid = ?", (rowid,)).fetchone()
+            if row:
+                cpfs.append(row[0])
+        return cpfs
+    finally:
+        conn.close()
+
+def time_lookups(connect, cpfs, reuse):
+    samples = []
+    conn = connect() if reuse else None
+    for cpf in cpfs:
+        start = time.perf_counter()
+        if not reuse:
+            conn = connect()
+        queries.search_cpf_by_cpf(cpf, conn.cursor())
+        if not reuse:
+            conn.close()
+        samples.append(time.perf_counter() - start)
+    if reuse:
+        conn.close()
+    return samples
+
+def bench_connections(args):
+    """
+    CPF lookup latency with plain sqlite3.connect (before) versus db.connect (after).
+    "cold" opens a new connection for every lookup, as the per-connection server
+    does; "warm" reuses one connection, as the pre-forked and asyncio workers do.
+    """
+    cpfs = sample_cpfs(args.cpf_db, args.lookups)
+    print(f"{len(cpfs)} random CPF lookups on {args.cpf_db}")
+    factories = [
+        ("before", lambda: sqlite3.connect(args.cpf_db)),
+        ("after", lambda: db.connect(args.cpf_db, immutable=args.immutable)),
+    ]
+    for label, connect in factories:
+        print(f"{label}:")
+        print_summary("cold connection", time_lookups(connect, cpfs, reuse=False))
+        print_summary("warm connection", time_lookups(connect, cpfs, reuse=True))
+
+def bench_formats(args):
+    """
+    Row dicts (the default response format) versus the columnar format for one
+    name search: time to build the result from the cursor, time to serialize
+    it, and payload size raw and gzipped.
+    """
+    conn = db.connect(args.cpf_db)
+    cursor = conn.cursor()
+    print(f"Name search '{args.name}' on {args.cpf_db}, median of {args.repeat} runs")
+    for label, columnar in (("dicts", False), ("columnar", True)):
+        build, serialize = [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = queries.search_cpf_by_name(args.name, cursor, columnar=columnar)
+            built = time.perf_counter()
+            payload = json.dumps({"results": result}, ensure_ascii=False).encode('utf-8')
+            build.append(built - start)
+            serialize.append(time.perf_counter() - built)
+        print(f"  {label:<9} rows={queries.result_size(result):<8} "
+              f"query+build={statistics.median(build) * 1000:8.1f}ms "
+              f"json.dumps={statistics.median(serialize) * 1000:8.1f}ms "
+              f"size={len(payload) / 1024:9.0f}KiB gzip={len(zlib.compress(payload, 6)) / 1024:7.0f}KiB")
+    conn.close()
+
+def bench_scan(args):
+    """
+    Full-scan name search, serial versus split into rowid ranges run in
+    parallel (parallel.Scanner), for each partition count. Every parallel
+    result is checked against the serial one. A rare name keeps the timing
+    about the scan itself rather than shipping rows back from the pool.
+    """
+    conn = db.connect(args.cpf_db)
+    cursor = conn.cursor()
+    kind = "threads" if args.threads else "processes"
+    print(f"Name search '{args.name}' on {args.cpf_db}, median of {args.repeat} runs, pool of {kind}")
+    timings = []
+    serial = None
+    for partitions in [1] + [p for p in args.partitions if p > 1]:
+        scanner = parallel.Scanner(partitions, threads=args.threads) if partitions > 1 else None
+        if scanner:
+            # Start the pool (and its connections) outside the timed runs
+            queries.search_cpf_by_name(args.name, cursor, scanner=scanner)
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = queries.search_cpf_by_name(args.name, cursor, scanner=scanner)
+            samples.append(time.perf_counter() - start)
+        if serial is None:
+            serial = result
+        elif sorted(map(str, result)) != sorted(map(str, serial)):
+            print(f"  partitions={partitions}: results differ from the serial scan")
+        timings.append((partitions, statistics.median(samples), len(result)))
+    for partitions, seconds, rows in timings:
+        print(f"  partitions={partitions:<3} rows={rows:<8} time={seconds * 1000:9.1f}ms "
+              f"speedup={timings[0][1] / seconds:5.2f}x")
+    parallel.shutdown()
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the query path')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    connections = subparsers.add_parser('connections', help='Cold and warm CPF lookups, plain versus tuned connections')
+    connections.add_argument('--cpf-db', default='db/basecpf.db',
+                             help='Path to the CPF database (default: db/basecpf.db)')
+    connections.add_argument('-n', '--lookups', type=int, default=2000,
+                             help='Number of lookups per scenario (default: 2000)')
+    connections.add_argument('--immutable', action='store_true',
+                             help='Open the tuned connections with immutable=1')
+    connections.set_defaults(func=bench_connections)
+
+    formats = subparsers.add_parser('formats', help='Row dicts versus columnar results: build, serialize, size')
+    formats.add_argument('--cpf-db', default='db/basecpf.db',
+                         help='Path to the CPF database (default: db/basecpf.db)')
+    formats.add_argument('--name', default='SILVA', help='Name searched (default: SILVA)')
+    formats.add_argument('-r', '--repeat', type=int, default=5, help='Runs per format (default: 5)')
+    formats.set_defaults(func=bench_formats)
+
+    scan = subparsers.add_parser('scan', help='Serial versus parallel (rowid ranges) full-scan name search')
+    scan.add_argument('--cpf-db', default='db/basecpf.db',
+                      help='Path to the CPF database (default: db/basecpf.db)')
+    scan.add_argument('--name', default='ZZQX', help='Name searched (default: ZZQX, matches almost nothing)')
+    scan.add_argument('-p', '--partitions', type=int, nargs='+', default=[2, 4, 8],
+                      help='Partition counts to compare with the serial scan (default: 2 4 8)')
+    scan.add_argument('--threads', action='store_true',
+                      help='Use the thread pool (what daemonic server workers use) instead of processes')
+    scan.add_argument('-r', '--repeat', type=int, default=3, help='Runs per partition count (default: 3)')
+    scan.set_defaults(func=bench_scan)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
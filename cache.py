@@ -0,0 +1,99 @@
+import collections
+import os
+import signal
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+# Results with more rows than this are not cached
+CACHE_MAX_ROWS = 1000
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 60.0
+
+
+class QueryCache():
+    """
+    Cache LRU com TTL para resultados de consultas. Roda dentro do processo do
+    CacheManager, de modo que todos os processos atendentes enxergam as mesmas
+    entradas através de um proxy.
+
+    Todo o cache é descartado quando algum dos arquivos de banco muda
+    (tamanho ou data de modificação, incluindo o arquivo -wal).
+    """
+
+    def __init__(self, db_paths, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.db_paths = list(db_paths)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.signature = self._db_signature()
+        self.counters = collections.Counter()
+
+    def _db_signature(self):
+        signature = []
+        for path in self.db_paths:
+            for name in (path, path + "-wal"):
+                try:
+                    st = os.stat(name)
+                    signature.append((st.st_mtime_ns, st.st_size))
+                except OSError:
+                    signature.append(None)
+        return tuple(signature)
+
+    def _check_signature(self):
+        signature = self._db_signature()
+        if signature != self.signature:
+            self.entries.clear()
+            self.signature = signature
+            self.counters["invalidations"] += 1
+
+    def get(self, key):
+        with self.lock:
+            self._check_signature()
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._check_signature()
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = {name: self.counters[name] for name in ("hits", "misses", "evictions", "expirations", "invalidations")}
+            stats["entries"] = len(self.entries)
+            stats["max_entries"] = self.max_entries
+            return stats
+
+
+class CacheManager(BaseManager):
+    pass
+
+CacheManager.register("QueryCache", QueryCache)
+
+
+def _ignore_sigint():
+    # Ctrl-C is handled by the server, which shuts the manager down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def start_cache(db_paths, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+    """Start the cache process. Returns (manager, proxy); the proxy can be shared with forked workers."""
+    manager = CacheManager()
+    manager.start(initializer=_ignore_sigint)
+    return manager, manager.QueryCache(db_paths, max_entries, ttl)
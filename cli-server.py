@@ -0,0 +1,158 @@
+import argparse
+import multiprocessing
+
+import admission
+import async_server
+import cache
+import cpf_index
+import db
+import logs
+import profiling
+import server
+
+ENGINES = server.Server.MODES + ("asyncio",)
+
+def main():
+    parser = argparse.ArgumentParser(description='Start the HTTPS query server without the GUI')
+    parser.add_argument('--cpf-db', required=True,
+                        help='Path to the CPF database')
+    parser.add_argument('--cnpj-db', required=True,
+                        help='Path to the CNPJ database')
+    parser.add_argument('--host', default='0.0.0.0',
+                        help='Address to listen on (default: 0.0.0.0)')
+    parser.add_argument('-p', '--port', type=int, default=5000,
+                        help='Port to listen on (default: 5000)')
+    parser.add_argument('-t', '--threads', type=int, default=multiprocessing.cpu_count(),
+                        help='Simultaneous requests / worker processes / query threads (default: CPU count)')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='process',
+                        help='Server engine; prefork and reuseport run -t worker processes (default: process)')
+    parser.add_argument('--report-interval', type=float,
+                        help='prefork/reuseport: log the connections of each worker process every this many seconds')
+
+    parser.add_argument('--cache-size', type=int, default=cache.DEFAULT_CACHE_SIZE,
+                        help=f'Entries in the shared result cache, 0 disables it (default: {cache.DEFAULT_CACHE_SIZE})')
+    parser.add_argument('--cache-ttl', type=float, default=cache.DEFAULT_CACHE_TTL,
+                        help=f'Seconds a cached result stays valid (default: {cache.DEFAULT_CACHE_TTL:g})')
+    parser.add_argument('--mmap-size', type=int, default=db.MMAP_SIZE // (1024 * 1024),
+                        help=f'MiB of each database file mapped into memory (default: {db.MMAP_SIZE // (1024 * 1024)})')
+    parser.add_argument('--db-cache-size', type=int, default=db.CACHE_SIZE,
+                        help=f'SQLite page cache per connection, in KiB (default: {db.CACHE_SIZE})')
+    parser.add_argument('--temp-store', choices=('DEFAULT', 'FILE', 'MEMORY'), default=db.TEMP_STORE,
+                        help=f'Where SQLite keeps temporary tables and sorts (default: {db.TEMP_STORE})')
+    parser.add_argument('--immutable', action='store_true',
+                        help='Open the databases as immutable (only if nothing writes to them while serving)')
+    parser.add_argument('--cpf-index', type=str,
+                        help=f'CPF index built by cpf_index.py (default: CPF database path + '
+                             f'{cpf_index.INDEX_SUFFIX}, used only if present and up to date)')
+
+    parser.add_argument('--scan-partitions', type=int, default=0,
+                        help='Split full-scan name searches into this many rowid ranges scanned in parallel by '
+                             'a pool of processes (-e asyncio only, unless --scan-threads; default: 0, serial)')
+    parser.add_argument('--scan-threads', action='store_true',
+                        help='process/prefork/reuseport: also apply --scan-partitions, with threads inside the '
+                             'worker processes (slower than serial in benchmark.py scan so far)')
+    parser.add_argument('--query-timeout', type=float,
+                        help='Seconds a query may run on any route before it is interrupted, 0 for no limit '
+                             '(default: per route, see server.QUERY_TIMEOUTS)')
+    parser.add_argument('--expensive-slots', type=int,
+                        help='Requests to the scanning routes (name searches, batch CPF) served at once '
+                             '(default: half of --threads)')
+    parser.add_argument('--admission-queue', type=int,
+                        help='Scanning requests that may wait for a slot before the server answers 503; a waiting '
+                             'request holds a worker (default: what is left of 3/4 of --threads)')
+    parser.add_argument('--admission-wait', type=float, default=admission.DEFAULT_QUEUE_TIMEOUT,
+                        help='Seconds a queued request waits for a slot before 503 '
+                             f'(default: {admission.DEFAULT_QUEUE_TIMEOUT:g})')
+    parser.add_argument('--log-level', choices=logs.LEVELS, default=logs.DEFAULT_LEVEL,
+                        help=f'Log level; DEBUG adds per-step lines for every request (default: {logs.DEFAULT_LEVEL})')
+    parser.add_argument('--log-format', choices=logs.FORMATS, default=logs.DEFAULT_FORMAT,
+                        help=f'Plain text or one JSON object per line (default: {logs.DEFAULT_FORMAT})')
+    parser.add_argument('--log-sample', type=float, default=logs.DEFAULT_SAMPLE_RATE,
+                        help='Fraction of requests that get an access log line, e.g. 0.01 '
+                             f'(default: {logs.DEFAULT_SAMPLE_RATE:g})')
+    parser.add_argument('--profile-dir', type=str,
+                        help=f'Profile requests with cProfile and write .pstats files here '
+                             f'(implied as {profiling.DEFAULT_DIRECTORY}/ by the other --profile options)')
+    parser.add_argument('--profile-sample', type=float, default=0.0,
+                        help='Fraction of requests profiled, e.g. 0.001 (default: 0)')
+    parser.add_argument('--profile-path', action='append', default=[],
+                        help='Always profile requests whose path starts with this (repeatable), '
+                             'e.g. /get-person-by-name/')
+    parser.add_argument('--profile-min-ms', type=float, default=0.0,
+                        help='Only keep profiles of requests that took at least this many ms (default: 0)')
+
+    args = parser.parse_args()
+
+    db_options = {
+        'mmap_size': args.mmap_size * 1024 * 1024,
+        'cache_size': args.db_cache_size,
+        'temp_store': args.temp_store,
+        'immutable': args.immutable,
+    }
+    log_options = {
+        'level': args.log_level,
+        'fmt': args.log_format,
+        'sample_rate': args.log_sample,
+    }
+    admission_options = {
+        'expensive_slots': args.expensive_slots,
+        'queue_size': args.admission_queue,
+        'queue_timeout': args.admission_wait,
+    }
+    profile_options = None
+    if args.profile_dir or args.profile_sample or args.profile_path:
+        profile_options = {
+            'directory': args.profile_dir or profiling.DEFAULT_DIRECTORY,
+            'sample_rate': args.profile_sample,
+            'paths': args.profile_path,
+            'min_ms': args.profile_min_ms,
+        }
+
+    if args.engine == 'asyncio':
+        srv = async_server.AsyncServer(
+            host=args.host,
+            port=args.port,
+            cpf_db=args.cpf_db,
+            cnpj_db=args.cnpj_db,
+            workers=args.threads,
+            cache_size=args.cache_size,
+            cache_ttl=args.cache_ttl,
+            db_options=db_options,
+            cpf_index_path=args.cpf_index,
+            log_options=log_options,
+            profile_options=profile_options,
+            query_timeout=args.query_timeout,
+            admission_options=admission_options,
+            scan_partitions=args.scan_partitions
+        )
+    else:
+        srv = server.Server(
+            host=args.host,
+            port=args.port,
+            cpf_db=args.cpf_db,
+            cnpj_db=args.cnpj_db,
+            semaphore=multiprocessing.BoundedSemaphore(args.threads),
+            mode=args.engine,
+            workers=args.threads,
+            cache_size=args.cache_size,
+            cache_ttl=args.cache_ttl,
+            db_options=db_options,
+            cpf_index_path=args.cpf_index,
+            log_options=log_options,
+            profile_options=profile_options,
+            query_timeout=args.query_timeout,
+            admission_options=admission_options,
+            report_interval=args.report_interval,
+            scan_partitions=args.scan_partitions,
+            scan_threads=args.scan_threads
+        )
+
+    try:
+        srv.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.stop()
+
+if __name__ == "__main__":
+    main()
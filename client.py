@@ -1,8 +1,13 @@
+import codecs
+import collections
+import json
 import socket
 import ssl
+import threading
 import urllib.parse
 import time
 import sys
+import zlib
 
 def menu():
     print("Menu:")
@@ -17,108 +22,261 @@ def menu():
     choice = input("Enter your choice: ")
     return choice
 
-def send_https_request(sock, path):
-    request = f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n"
-    sock.sendall(request.encode())
-    
-    # Aumentar o timeout para receber a resposta completa
-    sock.settimeout(60.0)  # 60 segundos para respostas maiores
-    
-    # Receber a resposta
-    print("Aguardando resposta do servidor...")
-    response = b""
-    start_time = time.time()
-    
-    # Inicialmente, vamos tentar obter pelo menos os headers
-    while b"\r\n\r\n" not in response:
-        try:
-            chunk = sock.recv(8192)  # Aumentei o tamanho do buffer
-            if not chunk:
-                break
-            response += chunk
-            if time.time() - start_time > 60:  # Timeout de segurança
-                print("Tempo limite excedido ao receber headers.")
+def quiet(*args, **kwargs):
+    pass
+
+def build_request(path, method="GET", body=b"", host="localhost", keep_alive=False, compressed=True):
+    headers = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if compressed:
+        # ResponseReader decompresses transparently
+        headers += "Accept-Encoding: gzip, deflate\r\n"
+    headers += "Connection: keep-alive\r\n" if keep_alive else "Connection: close\r\n"
+    if body or method == "POST":
+        headers += f"Content-Length: {len(body)}\r\n"
+    return headers.encode() + b"\r\n" + body
+
+class ResponseReader():
+    """
+    Parser incremental de uma resposta HTTP/1.1. O corpo é lido conforme chega,
+    decodificando Transfer-Encoding: chunked, e os bytes já consumidos saem do
+    buffer, de modo que respostas grandes não são reconcatenadas a cada leitura.
+    """
+
+    RECV_SIZE = 65536
+    MAX_HEADER_SIZE = 65536
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.status = None
+        self.headers = {}
+        # Fields sent after a chunked body, lower-cased like headers
+        self.trailers = {}
+        # True once the whole body was read, i.e. the connection can carry another request
+        self.complete = False
+        # Body bytes as received (compressed) and after decoding
+        self.wire_bytes = 0
+        self.body_bytes = 0
+
+    @property
+    def chunked(self):
+        return self.headers.get("transfer-encoding", "").lower() == "chunked"
+
+    @property
+    def reusable(self):
+        return self.complete and not self.buffer and self.headers.get("connection", "").lower() != "close"
+
+    def _recv(self):
+        data = self.sock.recv(self.RECV_SIZE)
+        self.buffer += data
+        return bool(data)
+
+    def _read_line(self):
+        while True:
+            end = self.buffer.find(b"\r\n")
+            if end != -1:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 2]
+                return line
+            if not self._recv():
+                raise ConnectionError("Connection closed in the middle of the response")
+
+    def _read_exact(self, size):
+        # Yields the next size bytes as they arrive
+        while size > 0:
+            if not self.buffer and not self._recv():
+                raise ConnectionError("Connection closed in the middle of the response")
+            piece = bytes(self.buffer[:size])
+            del self.buffer[:len(piece)]
+            size -= len(piece)
+            yield piece
+
+    def read_head(self):
+        """Read the status line and headers. Returns (status, headers) with lower-case header names."""
+        while True:
+            end = self.buffer.find(b"\r\n\r\n")
+            if end != -1:
                 break
-        except socket.timeout:
-            print("Timeout ao aguardar headers.")
-            break
-    
-    # Se não conseguimos os headers, retorna o que tiver
-    if b"\r\n\r\n" not in response:
-        print("Resposta incompleta recebida (sem headers completos).")
-        return response.decode('utf-8', errors='ignore')
-    
-    # Dividir em headers e corpo
-    headers_raw, body = response.split(b"\r\n\r\n", 1)
-    headers = headers_raw.decode('utf-8', errors='ignore')
-    
-    # Verificar se há Content-Length
-    content_length = None
-    for line in headers.splitlines():
-        if line.lower().startswith('content-length:'):
-            content_length = int(line.split(':', 1)[1].strip())
-            break
-    
-    # Se conhecemos o tamanho do corpo, continuamos recebendo até obtê-lo completo
-    if content_length is not None:
-        print(f"Esperando corpo da resposta ({content_length} bytes)...")
-        while len(body) < content_length:
-            try:
-                chunk = sock.recv(8192)
-                if not chunk:
-                    print("Conexão fechada antes de receber o corpo completo.")
-                    break
-                body += chunk
-                print(f"Recebido: {len(body)}/{content_length} bytes")
-                if time.time() - start_time > 120:  # 2 minutos no máximo
-                    print("Tempo limite excedido ao receber corpo.")
+            if len(self.buffer) > self.MAX_HEADER_SIZE:
+                raise ValueError("Response headers too large")
+            if not self._recv():
+                raise ConnectionError("Connection closed before the response headers")
+        status_line, *header_lines = bytes(self.buffer[:end]).decode("iso-8859-1").split("\r\n")
+        del self.buffer[:end + 4]
+        try:
+            self.status = int(status_line.split(" ")[1])
+        except (IndexError, ValueError):
+            raise ValueError(f"Malformed status line: {status_line!r}")
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            self.headers[name.strip().lower()] = value.strip()
+        return self.status, self.headers
+
+    def iter_body(self):
+        """
+        Yield the decoded body as it arrives: one item per chunk for chunked
+        responses, otherwise pieces of whatever size recv returned. gzip and
+        deflate bodies are decompressed on the fly.
+        """
+        decompressor = None
+        if self.headers.get("content-encoding", "").lower() in ("gzip", "deflate"):
+            # 32 + MAX_WBITS accepts both the gzip and the zlib header
+            decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        for piece in self._iter_raw_body():
+            self.wire_bytes += len(piece)
+            if decompressor:
+                piece = decompressor.decompress(piece)
+            if piece:
+                self.body_bytes += len(piece)
+                yield piece
+        if decompressor:
+            tail = decompressor.flush()
+            if tail:
+                self.body_bytes += len(tail)
+                yield tail
+
+    def _iter_raw_body(self):
+        if self.chunked:
+            while True:
+                size_line = self._read_line()
+                try:
+                    size = int(size_line.split(b";")[0].strip(), 16)
+                except ValueError:
+                    raise ValueError(f"Malformed chunk size: {size_line!r}")
+                if size == 0:
+                    # Trailer fields (e.g. Server-Timing) end with an empty line
+                    while True:
+                        line = self._read_line()
+                        if not line:
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        self.trailers[name.strip().lower()] = value.strip()
                     break
-            except socket.timeout:
-                print("Timeout ao aguardar corpo da resposta.")
-                break
-    else:
-        # Se não temos Content-Length, continuamos recebendo até a conexão fechar
-        print("Recebendo resposta de tamanho desconhecido...")
-        while True:
-            try:
-                chunk = sock.recv(8192)
-                if not chunk:
+                yield b"".join(self._read_exact(size))
+                if self._read_line():
+                    raise ValueError("Missing CRLF after chunk data")
+        elif "content-length" in self.headers:
+            yield from self._read_exact(int(self.headers["content-length"]))
+        else:
+            # No framing: the body ends when the server closes the connection
+            if self.buffer:
+                yield bytes(self.buffer)
+                self.buffer.clear()
+            while True:
+                try:
+                    data = self.sock.recv(self.RECV_SIZE)
+                except socket.timeout:
+                    return
+                if not data:
+                    return
+                yield data
+        self.complete = True
+
+    def iter_messages(self):
+        """
+        Yield each JSON message of the body as soon as it is complete. Handles
+        NDJSON and the one-message-per-chunk progress updates; bodies that are
+        not chunked are a single message, parsed once they are complete.
+        """
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        pending = ""
+        for piece in self.iter_body():
+            pending += text_decoder.decode(piece)
+            if not self.chunked:
+                continue
+            # Messages normally end at a chunk boundary, so this runs once per message
+            pos = 0
+            while True:
+                while pos < len(pending) and pending[pos].isspace():
+                    pos += 1
+                if pos == len(pending):
                     break
-                body += chunk
-                print(f"Recebido mais {len(chunk)} bytes...")
-                if time.time() - start_time > 120:  # 2 minutos no máximo
-                    print("Tempo limite excedido.")
+                try:
+                    message, pos = decoder.raw_decode(pending, pos)
+                except json.JSONDecodeError:
                     break
-            except socket.timeout:
-                # Timeout pode significar que acabou
-                break
+                yield message
+            pending = pending[pos:]
+        pending = (pending + text_decoder.decode(b"", final=True)).strip()
+        if pending:
+            yield json.loads(pending)
+
+def receive_response(sock, verbose=True):
+    """
+    Read one response from sock. Returns (status, headers, body), with status as
+    an int (None if the headers never arrived), headers as a dict with lower-case
+    names and body as bytes, already de-chunked.
+    """
+    log = print if verbose else quiet
+
+    # Aumentar o timeout para receber a resposta completa
+    sock.settimeout(60.0)  # 60 segundos para respostas maiores
+
+    log("Aguardando resposta do servidor...")
+    start_time = time.time()
+    reader = ResponseReader(sock)
+    try:
+        status, headers = reader.read_head()
+    except (ConnectionError, ValueError, socket.timeout) as e:
+        log(f"Resposta incompleta recebida (sem headers completos): {e}")
+        return None, {}, bytes(reader.buffer)
+
+    pieces = []
+    try:
+        for piece in reader.iter_body():
+            pieces.append(piece)
+    except (ConnectionError, ValueError, socket.timeout) as e:
+        log(f"Resposta interrompida antes do fim do corpo: {e}")
+    body = b"".join(pieces)
+
+    log(f"Resposta completa recebida em {time.time() - start_time:.2f} segundos ({len(body)} bytes).")
+    return status, headers, body
+
+def send_https_request(sock, path, verbose=True):
+    sock.sendall(build_request(path))
+    status, headers, body = receive_response(sock, verbose)
     
     # Retornar o corpo da resposta
     try:
-        total_time = time.time() - start_time
-        print(f"Resposta completa recebida em {total_time:.2f} segundos ({len(body)} bytes).")
         return body.decode('utf-8', errors='ignore')
     except Exception as e:
         print(f"Erro ao decodificar resposta: {e}")
         return f"Erro na decodificação: {len(body)} bytes recebidos"
 
-def connect_to_server(host, port, path, timeout=30.0):
+def create_ssl_context():
     # Create SSL context with proper configuration
     context = ssl.create_default_context()
     context.check_hostname = False
     context.verify_mode = ssl.CERT_NONE  # Skip certificate verification (use in dev only)
-    
+    return context
+
+def open_connection(host, port, context=None, timeout=30.0, session=None):
+    """
+    Connect and complete the TLS handshake, resuming session if one is given.
+    Returns (ssl_socket, handshake_seconds).
+    """
+    context = context or create_ssl_context()
+    sock = socket.create_connection((host, port), timeout=timeout)
     try:
-        # Create a new socket for the request
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        wrapped_sock = context.wrap_socket(sock, server_hostname=host)
-        
-        print(f"Conectando a {host}:{port}...")
-        wrapped_sock.connect((host, port))
-        print("Conexão estabelecida. Enviando requisição...")
+        wrapped_sock = context.wrap_socket(sock, server_hostname=host, do_handshake_on_connect=False,
+                                           session=session)
+        start = time.perf_counter()
+        wrapped_sock.do_handshake()
+        return wrapped_sock, time.perf_counter() - start
+    except BaseException:
+        sock.close()
+        raise
+
+def connect_to_server(host, port, path, timeout=30.0, verbose=True):
+    log = print if verbose else quiet
+    wrapped_sock = None
+    try:
+        log(f"Conectando a {host}:{port}...")
+        wrapped_sock, _ = open_connection(host, port, timeout=timeout)
+        log("Conexão estabelecida. Enviando requisição...")
         
-        result = send_https_request(wrapped_sock, path)
+        result = send_https_request(wrapped_sock, path, verbose)
         return result
     except ConnectionRefusedError:
         print(f"Erro: Conexão recusada pelo servidor em {host}:{port}.")
@@ -135,10 +293,215 @@ def connect_to_server(host, port, path, timeout=30.0):
             wrapped_sock.close()
         except:
             pass
+
+def retry_after(headers):
+    try:
+        return float(headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+
+class QueryTimeoutError(RequestError):
+    """The server gave up on the query after its time budget (HTTP 504, or an error message in a stream)."""
+
+    def __init__(self, status, message, timeout=None):
+        super().__init__(status, message)
+        self.timeout = timeout
+
+class ServerBusyError(RequestError):
+    """The server had no capacity for the request (HTTP 503); retry after retry_after seconds."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(status, message)
+        self.retry_after = retry_after
+
+
+
+class Client():
+    """
+    Cliente programático do servidor. Mantém um pool de conexões TLS keep-alive
+    e um único SSLContext; conexões novas retomam a última sessão TLS, evitando
+    o handshake completo. Pode ser usado por várias threads ao mesmo tempo.
+    """
+
+    # The server closes idle connections after 5s (server.KEEPALIVE_TIMEOUT)
+    IDLE_TIMEOUT = 4.0
+
+    def __init__(self, host, port, pool_size=4, timeout=30.0, context=None):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.context = context or create_ssl_context()
+        self.session = None
+        # Idle connections as (socket, last_used), most recently used last
+        self.idle = collections.deque()
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                self.idle.pop()[0].close()
+
+    def _acquire(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.idle:
+                sock, last_used = self.idle.pop()
+                if now - last_used < self.IDLE_TIMEOUT:
+                    self.stats["connections_reused"] += 1
+                    return sock, True
+                sock.close()
+        sock, _ = open_connection(self.host, self.port, self.context, self.timeout, self.session)
+        self.stats["connections_opened"] += 1
+        if sock.session_reused:
+            self.stats["sessions_resumed"] += 1
+        return sock, False
+
+    def _release(self, sock):
+        # TLS 1.3 tickets only arrive after the handshake, so grab the session once a response was read
+        if sock.session is not None:
+            self.session = sock.session
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    def _exchange(self, path, method, body, keep_alive):
+        """Send a request over a pooled connection and read the response head. Returns (sock, reader)."""
+        for attempt in range(2):
+            sock, reused = self._acquire()
+            try:
+                sock.sendall(build_request(path, method, body, self.host, keep_alive))
+                sock.settimeout(self.timeout)
+                reader = ResponseReader(sock)
+                reader.read_head()
+            except (OSError, ValueError):
+                sock.close()
+                # The server may have closed an idle connection just before we reused it
+                if reused and attempt == 0:
+                    continue
+                raise
+            self.stats["requests"] += 1
+            return sock, reader
+
+    def _finish(self, sock, reader, keep_alive=True):
+        self.stats["bytes_received"] += reader.wire_bytes
+        self.stats["bytes_decoded"] += reader.body_bytes
+        if keep_alive and reader.reusable:
+            self._release(sock)
+        else:
+            sock.close()
+
+    def request(self, path, method="GET", body=b"", keep_alive=True):
+        """Send one request over a pooled connection. Returns (status, headers, body)."""
+        sock, reader = self._exchange(path, method, body, keep_alive)
         try:
+            response = b"".join(reader.iter_body())
+        except BaseException:
             sock.close()
-        except:
-            pass
+            raise
+        self._finish(sock, reader, keep_alive)
+        return reader.status, reader.headers, response
+
+    def stream(self, path, method="GET", body=b""):
+        """
+        Yield the JSON messages of a streaming (chunked) response as they arrive.
+        The connection goes back to the pool only if the response is read to the end.
+        """
+        sock, reader = self._exchange(path, method, body, True)
+        try:
+            if reader.status >= 400:
+                response = b"".join(reader.iter_body())
+                if reader.status == 503:
+                    raise ServerBusyError(reader.status, response.decode("utf-8", errors="ignore"),
+                                          retry_after(reader.headers))
+                raise RequestError(reader.status, response.decode("utf-8", errors="ignore"))
+            for message in reader.iter_messages():
+                if message.get("status") == "error":
+                    if "timeout" in message:
+                        raise QueryTimeoutError(reader.status, message.get("message"), message["timeout"])
+                    raise RequestError(reader.status, message.get("message"))
+                yield message
+        except BaseException:
+            sock.close()
+            raise
+        self._finish(sock, reader)
+
+    def get_json(self, path, method="GET", body=b""):
+        status, headers, response = self.request(path, method, body)
+        try:
+            data = json.loads(response)
+        except ValueError:
+            raise RequestError(status, response.decode("utf-8", errors="ignore"))
+        if status == 504 and isinstance(data, dict):
+            raise QueryTimeoutError(status, data.get("error"), data.get("timeout"))
+        if status == 503:
+            raise ServerBusyError(status, data.get("error", data) if isinstance(data, dict) else data,
+                                  retry_after(headers))
+        if status >= 400:
+            raise RequestError(status, data.get("error", data) if isinstance(data, dict) else data)
+        return data
+
+    def health(self):
+        return self.get_json("/health")
+
+    def get_by_cpf(self, cpf):
+        return self.get_json(f"/get-person-by-cpf/{cpf}")["results"]
+
+    def search_by_name(self, name, exact=False):
+        """
+        All matches, from one streamed response (?stream=1): a single scan on the
+        server, where walking ?limit=&after= pages costs one scan per page when the
+        name indexes are missing.
+        """
+        return list(self.iter_by_name(name, exact))
+
+    def search_cnpj_by_name(self, name):
+        return list(self.iter_cnpj_by_name(name))
+
+    def iter_by_name(self, name, exact=False):
+        """Like search_by_name, but yields the rows as the server streams them."""
+        route = "/get-person-by-exact-name/" if exact else "/get-person-by-name/"
+        for message in self.stream(f"{route}{urllib.parse.quote(name)}?stream=1"):
+            yield from message.get("results", [])
+
+    def iter_cnpj_by_name(self, name):
+        for message in self.stream(f"/get-person-cnpj-by-name/{urllib.parse.quote(name)}?stream=1"):
+            yield from message.get("results", [])
+
+    def get_by_cpfs(self, cpfs):
+        """
+        Bulk lookup through POST /get-persons-by-cpf. Yields one row per input CPF,
+        in input order, as the server streams them; missing CPFs come back with
+        "found": False.
+        """
+        body = json.dumps([str(cpf) for cpf in cpfs]).encode()
+        for message in self.stream("/get-persons-by-cpf", "POST", body):
+            yield from message.get("results", [])
+
+    def get_companies(self, name, cpf, establishments=False):
+        """Companies where name/cpf is a partner; with establishments=True the name is a substring."""
+        route = "/get-person-cnpj-by-name-cpf-radical/" if establishments else "/get-person-cnpj-by-name-cpf/"
+        return self.get_json(f"{route}{urllib.parse.quote(name)}-{urllib.parse.quote(cpf)}")["results"]
+
+
+def print_results(title, result):
+    print(f"\n--- {title} ---\n")
+    print(json.dumps(result, indent=2, ensure_ascii=False))
 
 def main():
     # Default configuration
@@ -166,88 +529,69 @@ def main():
     print(f"Cliente configurado para conectar em {HOST}:{PORT}")
     print("Você pode especificar o host e porta como argumentos: python client.py <host> <port>")
     
-    # Set longer timeout for SSL handshake
-    socket.setdefaulttimeout(30.0)
+    client = Client(HOST, PORT)
 
     while True:
         choice = menu()
-        if choice == '1':
-            name = input("Enter name: ")
-            path = f"/get-person-by-name/{urllib.parse.quote(name)}"
-            result = connect_to_server(HOST, PORT, path)
-            if result:
-                print("\n--- RESULTADO DA PESQUISA ---\n")
-                print(result)
-            
-        elif choice == '2':
-            name = input("Enter exact name: ")
-            path = f"/get-person-by-exact-name/{urllib.parse.quote(name)}"
-            result = connect_to_server(HOST, PORT, path)
-            if result:
-                print("\n--- RESULTADO DA PESQUISA ---\n")
-                print(result)
-            
-        elif choice == '3':
-            cpf = input("Enter CPF: ")
-            path = f"/get-person-by-cpf/{cpf}"
-            result = connect_to_server(HOST, PORT, path)
-            if result:
-                print("\n--- RESULTADO DA PESQUISA ---\n")
-                print(result)
-            
-        elif choice == '4':
-            name = input("Enter name: ")
-            path = f"/get-person-cnpj-by-name/{urllib.parse.quote(name)}"
-            result = connect_to_server(HOST, PORT, path)
-            if result:
-                print("\n--- RESULTADO DA PESQUISA ---\n")
-                print(result)
-            
-        elif choice == '5':
-            name = input("Enter exact name: ")
-            cpf = input("Enter CPF: ")
-            path = f"/get-person-cnpj-by-name-cpf/{urllib.parse.quote(name)}-{urllib.parse.quote(cpf)}"
-            result = connect_to_server(HOST, PORT, path)
-            if result:
-                print("\n--- RESULTADO DA PESQUISA ---\n")
-                print(result)
-            
-        elif choice == '6':
-            name = input("Enter name: ")
-            cpf = input("Enter CPF: ")
-            path = f"/get-person-cnpj-by-name-cpf-radical/{urllib.parse.quote(name)}-{urllib.parse.quote(cpf)}"
-            result = connect_to_server(HOST, PORT, path)
-            if result:
-                print("\n--- RESULTADO DA PESQUISA ---\n")
-                print(result)
-            
-        elif choice == '7':
-            print("Testando conexão com o servidor (health check)...")
-            path = "/health"
-            result = connect_to_server(HOST, PORT, path, timeout=5.0)
-            if result:
-                print("\n--- RESULTADO DO HEALTH CHECK ---\n")
-                print(result)
+        try:
+            if choice == '1':
+                name = input("Enter name: ")
+                print_results("RESULTADO DA PESQUISA", client.search_by_name(name))
+
+            elif choice == '2':
+                name = input("Enter exact name: ")
+                print_results("RESULTADO DA PESQUISA", client.search_by_name(name, exact=True))
+
+            elif choice == '3':
+                cpf = input("Enter CPF: ")
+                print_results("RESULTADO DA PESQUISA", client.get_by_cpf(cpf))
+
+            elif choice == '4':
+                name = input("Enter name: ")
+                print_results("RESULTADO DA PESQUISA", client.search_cnpj_by_name(name))
+
+            elif choice == '5':
+                name = input("Enter exact name: ")
+                cpf = input("Enter CPF: ")
+                print_results("RESULTADO DA PESQUISA", client.get_companies(name, cpf))
+
+            elif choice == '6':
+                name = input("Enter name: ")
+                cpf = input("Enter CPF: ")
+                print_results("RESULTADO DA PESQUISA", client.get_companies(name, cpf, establishments=True))
+
+            elif choice == '7':
+                print("Testando conexão com o servidor (health check)...")
+                print_results("RESULTADO DO HEALTH CHECK", client.health())
                 print("\nServidor está funcionando corretamente.")
+
+            elif choice == '0':
+                print("Saindo do programa...")
+                break
+
             else:
-                print("\nNão foi possível conectar ao servidor!")
-                retry = input("Deseja tentar outra porta? (s/n): ")
-                if retry.lower() == 's':
-                    try:
-                        new_port = int(input("Digite o número da porta: "))
-                        PORT = new_port
-                        print(f"Porta atualizada para: {PORT}")
-                    except ValueError:
-                        print("Valor de porta inválido, mantendo a porta atual.")
-            
-        elif choice == '0':
-            print("Saindo do programa...")
-            break
-        
-        else:
-            print("Opção inválida, tente novamente.")
-        
+                print("Opção inválida, tente novamente.")
+
+        except RequestError as e:
+            print(f"Erro do servidor: {e}")
+        except ConnectionRefusedError:
+            print(f"Erro: Conexão recusada pelo servidor em {HOST}:{PORT}.")
+            print("Verifique se o servidor está rodando e se a porta está correta.")
+            retry = input("Deseja tentar outra porta? (s/n): ")
+            if retry.lower() == 's':
+                try:
+                    PORT = int(input("Digite o número da porta: "))
+                    client.close()
+                    client = Client(HOST, PORT)
+                    print(f"Porta atualizada para: {PORT}")
+                except ValueError:
+                    print("Valor de porta inválido, mantendo a porta atual.")
+        except (OSError, ssl.SSLError) as e:
+            print(f"Erro ao conectar ao servidor: {e}")
+
         print("\n" + "-"*50 + "\n")
 
+    client.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,259 @@
+import argparse
+import array
+import bisect
+import logging
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+
+import db
+import queries
+
+# Índice de CPFs pré-computado a partir do cpf.db, para a rota /get-person-by-cpf
+# não precisar passar pelo SQLite.
+#
+# Layout do arquivo (inteiros little-endian):
+#
+#     header    MAGIC, count, keys_offset, offsets_offset, records_offset,
+#               tamanho e mtime do banco de origem
+#     keys      count x uint64, os CPFs como inteiros, em ordem crescente
+#     offsets   (count + 1) x uint64, início de cada registro na área de registros
+#     records   nome, sexo e nasc de cada linha, separados por FIELD_SEP, em UTF-8
+#
+# Os processos mapeiam o arquivo com mmap e fazem busca binária direto sobre as
+# páginas mapeadas; só o registro encontrado é copiado.
+
+MAGIC = b"CPFIDX01"
+HEADER = struct.Struct("<8sQQQQQQ")
+FIELD_SEP = b"\x1f"
+NULL_FIELD = b"\x00"
+COLUMNS = ["cpf", "nome", "sexo", "nasc"]
+CPF_LENGTH = 11
+INDEX_SUFFIX = ".cpfidx"
+
+log = logging.getLogger("cpf_index")
+
+def default_path(cpf_db):
+    return cpf_db + INDEX_SUFFIX
+
+def db_signature(cpf_db):
+    st = os.stat(cpf_db)
+    return st.st_size, st.st_mtime_ns
+
+def cpf_key(cpf):
+    """The integer key of an 11-digit CPF, or None if cpf cannot be in the index."""
+    if not isinstance(cpf, str) or len(cpf) != CPF_LENGTH or not cpf.isdigit():
+        return None
+    return int(cpf)
+
+def encode_record(nome, sexo, nasc):
+    return FIELD_SEP.join(NULL_FIELD if value is None else str(value).encode("utf-8") for value in (nome, sexo, nasc))
+
+def decode_record(data):
+    return tuple(None if field == NULL_FIELD else field.decode("utf-8") for field in data.split(FIELD_SEP))
+
+
+class CpfIndex():
+    """Read-only view over an index file. Lookups are O(log n) and do not touch SQLite."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, self.count, keys_offset, offsets_offset, records_offset,
+             db_size, db_mtime_ns) = HEADER.unpack_from(self.mmap, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a CPF index file")
+            if sys.byteorder != "little":
+                raise ValueError("CPF index files can only be read on little-endian machines")
+            self.db_signature = (db_size, db_mtime_ns)
+            view = memoryview(self.mmap)
+            self.keys = view[keys_offset:keys_offset + 8 * self.count].cast("Q")
+            self.offsets = view[offsets_offset:offsets_offset + 8 * (self.count + 1)].cast("Q")
+            self.records = view[records_offset:]
+            view.release()
+        except BaseException:
+            self.mmap.close()
+            raise
+
+    def close(self):
+        for view in (self.keys, self.offsets, self.records):
+            view.release()
+        self.mmap.close()
+
+    def __len__(self):
+        return self.count
+
+    def row(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return (f"{self.keys[position]:0{CPF_LENGTH}d}",) + decode_record(bytes(self.records[start:end]))
+
+    def lookup(self, cpf):
+        """Rows for cpf as (cpf, nome, sexo, nasc) tuples, in the order SQLite returns them (by rowid)."""
+        key = cpf_key(cpf)
+        if key is None:
+            return []
+        position = bisect.bisect_left(self.keys, key)
+        rows = []
+        while position < self.count and self.keys[position] == key:
+            rows.append(self.row(position))
+            position += 1
+        return rows
+
+    def search(self, cpf, columnar=False):
+        """Same result as queries.search_cpf_by_cpf, in either response format."""
+        rows = self.lookup(cpf)
+        if columnar:
+            return queries.RowBatch(COLUMNS, rows).to_json()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+def load(path, cpf_db):
+    """
+    Open the index at path if it exists and was built from the current cpf_db.
+    Returns None (and the server falls back to SQLite) otherwise.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        index = CpfIndex(path)
+    except (OSError, ValueError) as e:
+        log.warning("CPF index %s ignored: %s", path, e)
+        return None
+    if index.db_signature != db_signature(cpf_db):
+        log.warning("CPF index %s ignored: %s changed since it was built (run cpf_index.py build again)", path, cpf_db)
+        index.close()
+        return None
+    return index
+
+def iter_db_rows(conn):
+    # idx_cpf_cpf returns the rows by (cpf, rowid), which is also the order of the index file
+    cursor = conn.execute("SELECT cpf, nome, sexo, nasc FROM cpf ORDER BY cpf, rowid")
+    while True:
+        rows = cursor.fetchmany(queries.STREAM_BATCH_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+def build(cpf_db, path):
+    """Write the index for cpf_db to path (atomically replacing it). Returns (rows indexed, rows skipped)."""
+    signature = db_signature(cpf_db)
+    conn = db.connect(cpf_db)
+    directory = os.path.dirname(os.path.abspath(path))
+    count = skipped = 0
+    with tempfile.TemporaryFile(dir=directory) as keys_file, \
+            tempfile.TemporaryFile(dir=directory) as offsets_file, \
+            tempfile.TemporaryFile(dir=directory) as records_file:
+        keys, offsets = array.array("Q"), array.array("Q", [0])
+        position = 0
+        for cpf, nome, sexo, nasc in iter_db_rows(conn):
+            key = cpf_key(cpf)
+            if key is None:
+                skipped += 1
+                continue
+            record = encode_record(nome, sexo, nasc)
+            records_file.write(record)
+            position += len(record)
+            keys.append(key)
+            offsets.append(position)
+            count += 1
+            if len(keys) >= 1 << 16:
+                keys.tofile(keys_file)
+                offsets.tofile(offsets_file)
+                keys, offsets = array.array("Q"), array.array("Q")
+        keys.tofile(keys_file)
+        offsets.tofile(offsets_file)
+        conn.close()
+
+        keys_offset = HEADER.size
+        offsets_offset = keys_offset + 8 * count
+        records_offset = offsets_offset + 8 * (count + 1)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=INDEX_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(HEADER.pack(MAGIC, count, keys_offset, offsets_offset, records_offset, *signature))
+                for section in (keys_file, offsets_file, records_file):
+                    section.seek(0)
+                    shutil.copyfileobj(section, out, 1 << 20)
+            # Workers that already mapped the old file keep reading it until they restart
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return count, skipped
+
+def verify(cpf_db, path, sample=None):
+    """
+    Cross-check the index against the database. Checks every row in order, or
+    with sample=N only N random CPFs through lookup(). Returns a list of problems.
+    """
+    problems = []
+    index = CpfIndex(path)
+    conn = db.connect(cpf_db)
+    try:
+        if index.db_signature != db_signature(cpf_db):
+            problems.append(f"{cpf_db} changed since the index was built")
+        if sample:
+            cursor = conn.cursor()
+            positions = random.sample(range(index.count), min(sample, index.count))
+            cpfs = [index.row(position)[0] for position in positions]
+            cpfs += [f"{random.randrange(10 ** CPF_LENGTH):0{CPF_LENGTH}d}" for _ in range(len(cpfs))]
+            for cpf in cpfs:
+                expected = [tuple(row.values()) for row in queries.search_cpf_by_cpf(cpf, cursor)]
+                if index.lookup(cpf) != expected:
+                    problems.append(f"CPF {cpf}: index {index.lookup(cpf)} != database {expected}")
+        else:
+            position = 0
+            for row in iter_db_rows(conn):
+                if cpf_key(row[0]) is None:
+                    continue
+                if position >= index.count:
+                    problems.append(f"Database row {row} missing from the index")
+                elif index.row(position) != tuple(row):
+                    problems.append(f"Position {position}: index {index.row(position)} != database {tuple(row)}")
+                position += 1
+                if len(problems) >= 20:
+                    problems.append("Too many differences, stopping")
+                    break
+            if position < index.count and len(problems) < 20:
+                problems.append(f"Index has {index.count - position} rows more than the database")
+        return problems
+    finally:
+        conn.close()
+        index.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory-mapped CPF index for /get-person-by-cpf')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('build', 'Build the index from the CPF database'),
+                            ('verify', 'Cross-check the index against the CPF database')):
+        command = subparsers.add_parser(name, help=help_text)
+        command.add_argument('--cpf-db', default='db/basecpf.db',
+                             help='Path to the CPF database (default: db/basecpf.db)')
+        command.add_argument('-o', '--output', type=str,
+                             help=f'Index file (default: the database path + {INDEX_SUFFIX})')
+    subparsers.choices['verify'].add_argument('-s', '--sample', type=int,
+                                              help='Check only this many random CPFs instead of every row')
+
+    args = parser.parse_args()
+    path = args.output or default_path(args.cpf_db)
+
+    if args.command == 'build':
+        count, skipped = build(args.cpf_db, path)
+        print(f"Index {path} built with {count} rows ({os.path.getsize(path) / 1024 / 1024:.1f} MiB)")
+        if skipped:
+            print(f"{skipped} rows skipped: CPF is not 11 digits (they are still found through SQLite)")
+    else:
+        problems = verify(args.cpf_db, path, args.sample)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print(f"Index {path} matches {args.cpf_db}")
+
+if __name__ == "__main__":
+    main()
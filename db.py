@@ -0,0 +1,103 @@
+import pathlib
+import sqlite3
+import time
+
+# Defaults for the query connections. The servers never write, so connections
+# are opened read-only and tuned for reads.
+MMAP_SIZE = 256 * 1024 * 1024   # bytes of the database file mapped into memory
+CACHE_SIZE = 64 * 1024          # page cache per connection, in KiB
+TEMP_STORE = "MEMORY"           # sorts and temporary B-trees stay in RAM
+
+# QueryGuard: SQLite virtual machine steps between checks (a few hundred
+# microseconds of work) and seconds between checks for a closed client socket
+PROGRESS_STEPS = 10000
+PEER_CHECK_INTERVAL = 0.1
+
+def connect(path, immutable=False, mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE, temp_store=TEMP_STORE,
+            check_same_thread=True):
+    """
+    Open a read-only connection to the SQLite database at path.
+
+    immutable=True tells SQLite the file cannot change while it is open, which
+    skips locking and change detection entirely. Only use it when nothing else
+    writes to the database while the server runs.
+    """
+    uri = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = {-int(cache_size)}")
+    conn.execute(f"PRAGMA temp_store = {temp_store}")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class QueryTimeout(Exception):
+    def __init__(self, timeout):
+        super().__init__(f"Query timed out after {timeout:g}s")
+        self.timeout = timeout
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class QueryGuard():
+    """
+    Interrompe a consulta SQLite em andamento quando ela passa do tempo
+    permitido ou quando o cliente desconecta. Instalado nas conexões com
+    install(); fica inativo (custo de uma chamada a cada PROGRESS_STEPS passos)
+    até arm().
+    """
+
+    def __init__(self):
+        self.timeout = None
+        self.deadline = None
+        self.peer_closed = None
+        self.reason = None
+        self._next_peer_check = 0.0
+
+    def install(self, conn):
+        conn.set_progress_handler(self._progress, PROGRESS_STEPS)
+
+    def arm(self, timeout=None, peer_closed=None):
+        """Guard the next queries: timeout in seconds (None or 0 for no limit), peer_closed a callable."""
+        self.timeout = timeout or None
+        self.peer_closed = peer_closed
+        self.reason = None
+        self.restart()
+
+    def restart(self):
+        """Start the time budget again, before each query or each batch of a stream."""
+        now = time.monotonic()
+        self.deadline = now + self.timeout if self.timeout else None
+        self._next_peer_check = now + PEER_CHECK_INTERVAL
+
+    def disarm(self):
+        self.timeout = self.deadline = self.peer_closed = None
+
+    def _progress(self):
+        if self.deadline is None and self.peer_closed is None:
+            return 0
+        now = time.monotonic()
+        if self.deadline is not None and now > self.deadline:
+            self.reason = "timeout"
+            return 1
+        if self.peer_closed is not None and now >= self._next_peer_check:
+            self._next_peer_check = now + PEER_CHECK_INTERVAL
+            if self.peer_closed():
+                self.reason = "disconnected"
+                return 1
+        return 0
+
+    def check(self):
+        """For waits outside SQLite: raise QueryTimeout or ClientDisconnected if the query should stop now."""
+        if self._progress():
+            self.raise_for(None)
+
+    def raise_for(self, error):
+        """Re-raise error, the sqlite3.OperationalError of an interrupted query, as QueryTimeout or ClientDisconnected."""
+        if self.reason == "timeout":
+            raise QueryTimeout(self.timeout) from error
+        if self.reason == "disconnected":
+            raise ClientDisconnected("Client closed the connection during the query") from error
@@ -1,10 +1,14 @@
+import logging
+
 from flask import Flask, jsonify
-import sqlite3
+import db
 from flask_cors import CORS, cross_origin
 
 
 app = Flask(__name__)
 CORS(app)  # This will enable CORS for all routes
+# Response bodies are only logged when this is set (and the logger is at DEBUG)
+app.config.setdefault('LOG_RESPONSE_BODIES', False)
 
 @app.route('/connectSuccess', methods=['POST'])
 @cross_origin()  # This enables CORS for this specific route
@@ -15,9 +19,8 @@ def connect_success():
 @app.route("/get-person-by-name/<name>")
 @cross_origin()  # This enables CORS for this specific route
 def get_person_by_name(name):
-    conn_cnpj = sqlite3.connect('db/cnpj.db')
-    conn_cpf = sqlite3.connect('db/basecpf.db')
-    print('conn_cpf', conn_cpf)
+    conn_cnpj = db.connect('db/cnpj.db')
+    conn_cpf = db.connect('db/basecpf.db')
     cursor_cnpj = conn_cnpj.cursor()
     cursor_cpf = conn_cpf.cursor()
     cursor_cpf.execute("SELECT * FROM cpf WHERE nome LIKE UPPER(?)", ('%' + name + '%',))
@@ -39,8 +42,8 @@ def get_person_by_name(name):
 @app.route("/get-person-by-exact-name/<name>")
 @cross_origin()  # This enables CORS for this specific route
 def get_person_by_exact_name(name):
-    conn_cnpj = sqlite3.connect('db/cnpj.db')
-    conn_cpf = sqlite3.connect('db/basecpf.db')
+    conn_cnpj = db.connect('db/cnpj.db')
+    conn_cpf = db.connect('db/basecpf.db')
     cursor_cnpj = conn_cnpj.cursor()
     cursor_cpf = conn_cpf.cursor()
     cursor_cpf.execute("SELECT * FROM cpf WHERE nome = UPPER(?)", (name,))
@@ -62,8 +65,8 @@ def get_person_by_exact_name(name):
 @app.route("/get-person-by-cpf/<cpf>", methods=['GET'])
 @cross_origin()  # This enables CORS for this specific route
 def get_person_by_cpf(cpf):
-    conn_cnpj = sqlite3.connect('db/cnpj.db')
-    conn_cpf = sqlite3.connect('db/basecpf.db')
+    conn_cnpj = db.connect('db/cnpj.db')
+    conn_cpf = db.connect('db/basecpf.db')
     cursor_cnpj = conn_cnpj.cursor()
     cursor_cpf = conn_cpf.cursor()
     cursor_cpf.execute("SELECT * FROM cpf WHERE cpf = ?", (cpf,))
@@ -78,7 +81,6 @@ def get_person_by_cpf(cpf):
                 'nasc': row[3]
             }
             cpf_list.append(cpf_info)
-            print(cpf_list)
         return jsonify({'results': cpf_list}), 200
     else:
         return jsonify({'error': 'CPF não encontrado'}), 404
@@ -86,8 +88,8 @@ def get_person_by_cpf(cpf):
 @app.route("/get-person-cnpj-by-name/<name>")
 @cross_origin()  # This enables CORS for this specific route
 def get_person_cnpj_by_name(name):
-    conn_cnpj = sqlite3.connect('db/cnpj.db')
-    conn_cpf = sqlite3.connect('db/basecpf.db')
+    conn_cnpj = db.connect('db/cnpj.db')
+    conn_cpf = db.connect('db/basecpf.db')
     cursor_cnpj = conn_cnpj.cursor()
     cursor_cpf = conn_cpf.cursor()
     cursor_cnpj.execute("SELECT * FROM socios WHERE nome LIKE UPPER(?)", ('%' + name + '%',))
@@ -107,8 +109,8 @@ def get_person_cnpj_by_name(name):
 @app.route("/get-person-cnpj-by-name-cpf/<name>-<cpf>")
 @cross_origin()  # This enables CORS for this specific route
 def get_person_cnpj_by_cpf(name, cpf):
-    conn_cnpj = sqlite3.connect('db/cnpj.db')
-    conn_cpf = sqlite3.connect('db/basecpf.db')
+    conn_cnpj = db.connect('db/cnpj.db')
+    conn_cpf = db.connect('db/basecpf.db')
     cursor_cnpj = conn_cnpj.cursor()
     cursor_cpf = conn_cpf.cursor()
     cursor_cnpj.execute("SELECT * FROM socios WHERE representante_legal LIKE ? AND nome_representante LIKE ?", ('%' + cpf[3:9] + '%', '%' + name + '%',))
@@ -128,8 +130,8 @@ def get_person_cnpj_by_cpf(name, cpf):
 
 @app.route("/get-person-cnpj-by-name-cpf-radical/<name>-<cpf>")
 def get_person_cnpj_by_cpf_radical(name, cpf):
-    conn_cnpj = sqlite3.connect('db/cnpj.db')
-    conn_cpf = sqlite3.connect('db/basecpf.db')
+    conn_cnpj = db.connect('db/cnpj.db')
+    conn_cpf = db.connect('db/basecpf.db')
     cursor_cnpj = conn_cnpj.cursor()
     cursor_cpf = conn_cpf.cursor()
     cursor_cnpj.execute("SELECT * FROM socios WHERE cpf_cnpj LIKE ? AND nome LIKE ?", ('%' + cpf[3:9] + '%', '%' + name + '%',))
@@ -162,9 +164,10 @@ def get_person_cnpj_by_cpf_radical(name, cpf):
 
 @app.after_request
 def after_request(response):
-    print("Status:", response.status)
-    print("Headers:", response.headers)
-    print("Response data:", response.get_data(as_text=True))
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("Status: %s, %s bytes", response.status, response.content_length)
+        if app.config['LOG_RESPONSE_BODIES']:
+            app.logger.debug("Response data: %s", response.get_data(as_text=True))
     return response
 
 if __name__ == "__main__":
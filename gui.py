@@ -1,5 +1,6 @@
 from PyQt5 import QtWidgets, QtCore
 import server
+import async_server
 from multiprocessing import Manager
 import multiprocessing
 
@@ -15,7 +16,7 @@ class Window(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Python QT5 Server")
-        self.setFixedSize(500, 160)
+        self.setFixedSize(500, 190)
         self.cpf_db = None
         self.cnpj_db = None
         self.server = None
@@ -41,6 +42,10 @@ class Window(QtWidgets.QWidget):
         self.threads_field.setValue(default_threads)
         self.threads_field.setPrefix("Threads: ")
 
+        # Server mode field
+        self.mode_field = QtWidgets.QComboBox()
+        self.mode_field.addItems(list(server.Server.MODES) + ["asyncio"])
+
         # Port field
         self.port_field = QtWidgets.QLineEdit('5000')
         self.port_field.setPlaceholderText("Port")
@@ -55,6 +60,13 @@ class Window(QtWidgets.QWidget):
         self.error_label.setAlignment(QtCore.Qt.AlignCenter)
         self.error_label.setWordWrap(True)
 
+        # Connections per worker process (prefork and reuseport), refreshed every second
+        self.connections_label = QtWidgets.QLabel("")
+        self.connections_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.connections_label.setWordWrap(True)
+        self.connections_timer = QtCore.QTimer(self)
+        self.connections_timer.setInterval(1000)
+
         # Layouts
         cpf_layout = QtWidgets.QHBoxLayout()
         cpf_layout.addWidget(self.cpf_db_field)
@@ -66,11 +78,15 @@ class Window(QtWidgets.QWidget):
 
         hostport_layout = QtWidgets.QHBoxLayout()
         hostport_layout.addWidget(self.threads_field)
+        hostport_layout.addWidget(self.mode_field)
         hostport_layout.addWidget(self.port_field)
 
         error_layout = QtWidgets.QHBoxLayout()
         error_layout.addWidget(self.error_label)
 
+        connections_layout = QtWidgets.QHBoxLayout()
+        connections_layout.addWidget(self.connections_label)
+
         startstop_layout = QtWidgets.QHBoxLayout()
         startstop_layout.addWidget(self.start_server_button)
         startstop_layout.addWidget(self.stop_server_button)
@@ -85,6 +101,7 @@ class Window(QtWidgets.QWidget):
         main_layout.addLayout(cnpj_layout)
         main_layout.addLayout(hostport_layout)
         main_layout.addLayout(error_layout)
+        main_layout.addLayout(connections_layout)
         main_layout.addLayout(startstop_layout)
         main_layout.addLayout(close_layout)
 
@@ -96,6 +113,7 @@ class Window(QtWidgets.QWidget):
         self.start_server_button.clicked.connect(self.start_server_handler)
         self.stop_server_button.clicked.connect(self.stop_server_handler)
         self.close_button.clicked.connect(self.close)
+        self.connections_timer.timeout.connect(self.update_connections)
 
     def select_cpf_db(self):
         path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Select CPF Database")
@@ -122,20 +140,47 @@ class Window(QtWidgets.QWidget):
         except ValueError:
             self.error_label.setText("Invalid port number")
             return
-        self.manager = Manager()
-        self.semaphore = self.manager.BoundedSemaphore(threads)
-        self.server = server.Server(
-            host = "0.0.0.0",
-            port = int(port),
-            cpf_db = self.cpf_db,
-            cnpj_db = self.cnpj_db,
-            semaphore = self.semaphore
-        )
+        mode = self.mode_field.currentText()
+        if mode == "asyncio":
+            self.server = async_server.AsyncServer(
+                host = "0.0.0.0",
+                port = int(port),
+                cpf_db = self.cpf_db,
+                cnpj_db = self.cnpj_db,
+                workers = threads
+            )
+        else:
+            self.manager = Manager()
+            self.semaphore = self.manager.BoundedSemaphore(threads)
+            try:
+                self.server = server.Server(
+                    host = "0.0.0.0",
+                    port = int(port),
+                    cpf_db = self.cpf_db,
+                    cnpj_db = self.cnpj_db,
+                    semaphore = self.semaphore,
+                    mode = mode,
+                    workers = threads
+                )
+            except ValueError as e:
+                # e.g. reuseport on a platform without SO_REUSEPORT
+                self.error_label.setText(str(e))
+                return
         self.server_thread = ServerThread(self.server)
         self.server_thread.start()
+        if mode in server.Server.POOL_MODES:
+            self.connections_timer.start()
+
+    def update_connections(self):
+        if not self.server:
+            return
+        workers = self.server.metrics.worker_connections()
+        self.connections_label.setText("Connections (accepted/open): " + "  ".join(
+            f"{w['pid']}: {w['accepted']}/{w['open']}" for w in workers))
 
     def stop_server_handler(self):
         print("Server.stop() called.")
+        self.connections_timer.stop()
         if self.server:
             self.server.stop()
             print("Server stopped successfully.")
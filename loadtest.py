@@ -0,0 +1,248 @@
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.parse
+
+import client
+from benchmark import percentile
+
+# Request kinds and their default share of the load
+ROUTES = ("cpf", "name", "exact-name", "cnpj-name", "batch", "health")
+DEFAULT_MIX = "cpf=60,name=15,exact-name=15,health=10"
+PERCENTILES = (50, 90, 99, 99.9)
+
+def load_csv(path):
+    """Values written by random_cpf_generator.py: one comma-separated line (newlines are accepted too)."""
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [value.strip() for value in f.read().replace('\n', ',').split(',') if value.strip()]
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        route, _, weight = part.partition('=')
+        route = route.strip()
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route '{route}' (choose from {', '.join(ROUTES)})")
+        try:
+            weights[route] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for '{route}': {weight}")
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one route with a positive weight")
+    return weights
+
+def git_revision():
+    # Revision of this checkout, wherever the load test is started from
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadTest():
+    """
+    Drives the server from `concurrency` threads until `duration` seconds have
+    passed (or `max_requests` were sent). Every request opens its own TLS
+    connection through client.py, so the handshake is part of each sample and
+    is also reported on its own.
+    """
+
+    def __init__(self, host, port, cpfs, names, mix, concurrency=10, duration=30.0, max_requests=None,
+                 page_limit=100, batch_size=100, timeout=30.0, compressed=True):
+        self.host = host
+        self.port = port
+        self.cpfs = cpfs
+        self.names = names
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.page_limit = page_limit
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.compressed = compressed
+        self.context = client.create_ssl_context()
+
+        needs_cpfs = {"cpf", "batch"}
+        needs_names = {"name", "exact-name", "cnpj-name"}
+        self.mix = {route: weight for route, weight in mix.items()
+                    if weight > 0 and (cpfs or route not in needs_cpfs) and (names or route not in needs_names)}
+        if not self.mix:
+            raise ValueError("No route in the mix can run with the given CPF and name lists")
+
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.samples = collections.defaultdict(list)
+        self.handshakes = []
+        self.statuses = collections.Counter()
+        self.errors = collections.Counter()
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.started_at = None
+
+    def next_request(self, rng):
+        route = rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if route == "cpf":
+            return route, "GET", f"/get-person-by-cpf/{rng.choice(self.cpfs)}", b""
+        if route == "batch":
+            body = json.dumps(rng.sample(self.cpfs, min(self.batch_size, len(self.cpfs)))).encode()
+            return route, "POST", "/get-persons-by-cpf", body
+        if route == "health":
+            return route, "GET", "/health", b""
+        name = urllib.parse.quote(rng.choice(self.names))
+        path = {"name": "/get-person-by-name/", "exact-name": "/get-person-by-exact-name/",
+                "cnpj-name": "/get-person-cnpj-by-name/"}[route] + name
+        return route, "GET", f"{path}?limit={self.page_limit}", b""
+
+    def take_slot(self, deadline):
+        with self.lock:
+            if time.perf_counter() >= deadline:
+                return False
+            if self.max_requests is not None and self.sent >= self.max_requests:
+                return False
+            self.sent += 1
+            return True
+
+    def run_one(self, route, method, path, body):
+        start = time.perf_counter()
+        sock = None
+        try:
+            sock, handshake = client.open_connection(self.host, self.port, self.context, self.timeout)
+            sock.sendall(client.build_request(path, method, body, compressed=self.compressed))
+            reader = client.ResponseReader(sock)
+            status, _ = reader.read_head()
+            for _ in reader.iter_body():
+                pass
+        except Exception as e:
+            with self.lock:
+                self.errors[type(e).__name__] += 1
+            return
+        finally:
+            if sock:
+                sock.close()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples[route].append(elapsed)
+            self.handshakes.append(handshake)
+            self.statuses[status] += 1
+            self.bytes_received += reader.wire_bytes
+            self.bytes_decoded += reader.body_bytes
+            if status is None or status >= 400:
+                self.errors[f"HTTP {status}"] += 1
+
+    def worker(self, deadline, seed):
+        rng = random.Random(seed)
+        while self.take_slot(deadline):
+            self.run_one(*self.next_request(rng))
+
+    def run(self):
+        self.started_at = datetime.datetime.now()
+        start = time.perf_counter()
+        deadline = start + self.duration
+        threads = [threading.Thread(target=self.worker, args=(deadline, i), daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - start)
+
+    @staticmethod
+    def latency_summary(samples):
+        summary = {f"p{p:g}": percentile(samples, p) * 1000 for p in PERCENTILES}
+        summary["mean"] = sum(samples) / len(samples) * 1000 if samples else 0.0
+        summary["max"] = max(samples) * 1000 if samples else 0.0
+        return summary
+
+    def report(self, elapsed):
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        completed = len(all_samples)
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "target": f"{self.host}:{self.port}",
+            "concurrency": self.concurrency,
+            "mix": self.mix,
+            "elapsed_s": elapsed,
+            "requests": completed + sum(count for name, count in self.errors.items() if not name.startswith("HTTP")),
+            "completed": completed,
+            "throughput_rps": completed / elapsed if elapsed else 0.0,
+            "compressed": self.compressed,
+            "bytes_received": self.bytes_received,
+            "bytes_decoded": self.bytes_decoded,
+            "latency_ms": self.latency_summary(all_samples),
+            "handshake_ms": self.latency_summary(self.handshakes),
+            "routes": {route: dict(count=len(samples), **self.latency_summary(samples))
+                       for route, samples in sorted(self.samples.items())},
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            "errors": dict(self.errors),
+        }
+
+
+def format_latency(summary):
+    return " ".join(f"{name}={value:.2f}" for name, value in summary.items())
+
+def print_report(report):
+    print(f"Target {report['target']} @ {report['git_revision'] or 'unknown revision'}, "
+          f"concurrency {report['concurrency']}, {report['elapsed_s']:.1f}s")
+    print(f"Requests:     {report['requests']} ({report['completed']} completed)")
+    print(f"Throughput:   {report['throughput_rps']:.1f} req/s, {report['bytes_received'] / 1024:.0f} KiB received "
+          f"({report['bytes_decoded'] / 1024:.0f} KiB decoded)")
+    print(f"Latency ms:   {format_latency(report['latency_ms'])}")
+    print(f"Handshake ms: {format_latency(report['handshake_ms'])}")
+    for route, summary in report["routes"].items():
+        summary = dict(summary)
+        count = summary.pop("count")
+        print(f"  {route:<11} n={count:<7} {format_latency(summary)}")
+    print(f"Statuses:     {report['statuses']}")
+    print(f"Errors:       {report['errors'] or 'none'}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator and latency benchmark for the HTTPS server')
+    parser.add_argument('host', nargs='?', default='localhost', help='Server host (default: localhost)')
+    parser.add_argument('port', nargs='?', type=int, default=5000, help='Server port (default: 5000)')
+    parser.add_argument('--cpfs', type=str, help='CPF list, e.g. the *_cpfs.csv written by random_cpf_generator.py')
+    parser.add_argument('--names', type=str, help='Name list, e.g. the *_names.csv written by random_cpf_generator.py')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='Number of concurrent clients (default: 10)')
+    parser.add_argument('-d', '--duration', type=float, default=30.0,
+                        help='Test duration in seconds (default: 30)')
+    parser.add_argument('-n', '--requests', type=int,
+                        help='Stop after this many requests, even before the duration ends')
+    parser.add_argument('-m', '--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f'Request mix as route=weight pairs from {", ".join(ROUTES)} (default: {DEFAULT_MIX})')
+    parser.add_argument('--page-limit', type=int, default=100,
+                        help='?limit= sent with the name searches (default: 100)')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='CPFs per POST /get-persons-by-cpf request (default: 100)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Socket timeout in seconds (default: 30)')
+    parser.add_argument('--no-compression', action='store_true',
+                        help='Do not send Accept-Encoding: gzip, deflate')
+    parser.add_argument('--json', type=str, help='Also write the report as JSON to this file')
+
+    args = parser.parse_args()
+    try:
+        test = LoadTest(args.host, args.port, load_csv(args.cpfs), load_csv(args.names), args.mix,
+                        concurrency=args.concurrency, duration=args.duration, max_requests=args.requests,
+                        page_limit=args.page_limit, batch_size=args.batch_size, timeout=args.timeout,
+                        compressed=not args.no_compression)
+    except ValueError as e:
+        parser.error(str(e))
+
+    report = test.run()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.json}")
+
+if __name__ == "__main__":
+    main()
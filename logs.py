@@ -0,0 +1,103 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import random
+import sys
+
+# Os processos do servidor não escrevem direto no stdout: cada registro vai para
+# uma multiprocessing.Queue (QueueHandler) e um único processo ouvinte formata e
+# escreve. Um terminal lento atrasa só o ouvinte, não quem está atendendo.
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+FORMATS = ("text", "json")
+DEFAULT_LEVEL = "INFO"
+DEFAULT_FORMAT = "text"
+# Fraction of the per-request lines (logger REQUEST_LOGGER) that are kept
+DEFAULT_SAMPLE_RATE = 1.0
+REQUEST_LOGGER = "server.requests"
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s [%(process)d] %(name)s: %(message)s"
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro, com os campos passados em extra=."""
+
+    FIELDS = ("method", "path", "route", "ms", "bytes", "rows")
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        data.update({field: getattr(record, field) for field in self.FIELDS if hasattr(record, field)})
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """Keeps a random fraction of the records, so busy servers can log only some requests."""
+
+    def __init__(self, rate=DEFAULT_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def _listen(queue, fmt):
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    while True:
+        try:
+            record = queue.get()
+        except (KeyboardInterrupt, EOFError):
+            continue
+        if record is None:
+            break
+        handler.handle(record)
+
+def start(level=DEFAULT_LEVEL, fmt=DEFAULT_FORMAT, sample_rate=DEFAULT_SAMPLE_RATE):
+    """
+    Start the listener process and route the root logger to it. Must run before
+    the server forks: child processes inherit the handler and the queue. Calling
+    it again only changes the level and the sample rate.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    request_logger = logging.getLogger(REQUEST_LOGGER)
+    for existing in [f for f in request_logger.filters if isinstance(f, SampleFilter)]:
+        request_logger.removeFilter(existing)
+    request_logger.addFilter(SampleFilter(sample_rate))
+    if _listener is not None:
+        return
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_listen, args=(queue, fmt), name="log-listener", daemon=True)
+    process.start()
+    handler = logging.handlers.QueueHandler(queue)
+    root.addHandler(handler)
+    _listener = (process, queue, handler)
+    # Registered after multiprocessing's own exit hook, so it runs first and the
+    # listener drains the queue before daemon processes are terminated
+    atexit.register(stop)
+
+def stop():
+    """Flush the queue and stop the listener. Later records fall back to logging's default stderr output."""
+    global _listener
+    if _listener is None:
+        return
+    process, queue, handler = _listener
+    _listener = None
+    logging.getLogger().removeHandler(handler)
+    queue.put(None)
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
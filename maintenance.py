@@ -0,0 +1,128 @@
+import argparse
+import sqlite3
+import time
+
+import queries
+
+# Indexes used by the queries in queries.py: (name, table, columns).
+# Name columns are indexed with NOCASE so that "nome = ? COLLATE NOCASE" and
+# case-insensitive "nome LIKE 'PREFIX%'" can seek on them. The trailing key
+# column matches the keyset pagination order (see queries.paginate); its last
+# column, the rowid, is part of every SQLite index entry and cannot be listed.
+CPF_INDEXES = [
+    ("idx_cpf_cpf", "cpf", "cpf"),
+    ("idx_cpf_nome", "cpf", "nome COLLATE NOCASE, cpf"),
+]
+CNPJ_INDEXES = [
+    ("idx_socios_cpf_cnpj", "socios", "cpf_cnpj"),
+    ("idx_socios_nome", "socios", "nome COLLATE NOCASE, cpf_cnpj"),
+    ("idx_empresas_radical", "empresas", "radical"),
+    ("idx_estabelecimentos_radical", "estabelecimentos", "radical"),
+]
+
+def build_indexes(db_path, indexes):
+    """
+    Create the missing indexes, recreate the ones whose definition changed and
+    refresh the planner statistics with ANALYZE.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        for name, table, columns in indexes:
+            start = time.time()
+            sql = f"CREATE INDEX {name} ON {table}({columns})"
+            existing = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()
+            if existing and existing[0] == sql:
+                print(f"  {name}: already exists")
+                continue
+            if existing:
+                conn.execute(f"DROP INDEX {name}")
+            conn.execute(sql)
+            conn.commit()
+            print(f"  {name} ON {table}({columns}): {time.time() - start:.1f}s")
+        start = time.time()
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"  ANALYZE: {time.time() - start:.1f}s")
+    finally:
+        conn.close()
+
+def build_name_index(db_path):
+    """
+    Create (or rebuild) the FTS5 trigram index over cpf.nome used by
+    queries.search_cpf_by_name.
+
+    The index is an external-content table: it stores only the trigrams and
+    points back to cpf by rowid. Triggers keep it in sync with later writes.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {queries.CPF_NAME_FTS}
+                USING fts5(nome, content='cpf', content_rowid='rowid', tokenize='trigram');
+
+            CREATE TRIGGER IF NOT EXISTS {queries.CPF_NAME_FTS}_ai AFTER INSERT ON cpf BEGIN
+                INSERT INTO {queries.CPF_NAME_FTS}(rowid, nome) VALUES (new.rowid, new.nome);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {queries.CPF_NAME_FTS}_ad AFTER DELETE ON cpf BEGIN
+                INSERT INTO {queries.CPF_NAME_FTS}({queries.CPF_NAME_FTS}, rowid, nome) VALUES ('delete', old.rowid, old.nome);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {queries.CPF_NAME_FTS}_au AFTER UPDATE OF nome ON cpf BEGIN
+                INSERT INTO {queries.CPF_NAME_FTS}({queries.CPF_NAME_FTS}, rowid, nome) VALUES ('delete', old.rowid, old.nome);
+                INSERT INTO {queries.CPF_NAME_FTS}(rowid, nome) VALUES (new.rowid, new.nome);
+            END;
+        """)
+        conn.execute(f"INSERT INTO {queries.CPF_NAME_FTS}({queries.CPF_NAME_FTS}) VALUES ('rebuild')")
+        conn.execute(f"INSERT INTO {queries.CPF_NAME_FTS}({queries.CPF_NAME_FTS}) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+
+def drop_name_index(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(f"""
+            DROP TRIGGER IF EXISTS {queries.CPF_NAME_FTS}_ai;
+            DROP TRIGGER IF EXISTS {queries.CPF_NAME_FTS}_ad;
+            DROP TRIGGER IF EXISTS {queries.CPF_NAME_FTS}_au;
+            DROP TABLE IF EXISTS {queries.CPF_NAME_FTS};
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Database maintenance commands for the query server')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_indexes_parser = subparsers.add_parser('build-indexes', help='Create the indexes used by the queries and run ANALYZE')
+    build_indexes_parser.add_argument('--cpf-db', default='db/basecpf.db',
+                                      help='Path to the CPF database (default: db/basecpf.db)')
+    build_indexes_parser.add_argument('--cnpj-db', default='db/cnpj.db',
+                                      help='Path to the CNPJ database (default: db/cnpj.db)')
+
+    build_fts = subparsers.add_parser('build-fts', help='Build the trigram index used by name substring searches')
+    build_fts.add_argument('--cpf-db', default='db/basecpf.db',
+                           help='Path to the CPF database (default: db/basecpf.db)')
+
+    drop_fts = subparsers.add_parser('drop-fts', help='Remove the trigram index (searches fall back to LIKE scans)')
+    drop_fts.add_argument('--cpf-db', default='db/basecpf.db',
+                          help='Path to the CPF database (default: db/basecpf.db)')
+
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == 'build-indexes':
+        print(f"Indexing {args.cpf_db}...")
+        build_indexes(args.cpf_db, CPF_INDEXES)
+        print(f"Indexing {args.cnpj_db}...")
+        build_indexes(args.cnpj_db, CNPJ_INDEXES)
+    elif args.command == 'build-fts':
+        print(f"Building {queries.CPF_NAME_FTS} in {args.cpf_db}...")
+        build_name_index(args.cpf_db)
+    elif args.command == 'drop-fts':
+        print(f"Dropping {queries.CPF_NAME_FTS} from {args.cpf_db}...")
+        drop_name_index(args.cpf_db)
+    print(f"Done in {time.time() - start:.1f} seconds")
+
+if __name__ == "__main__":
+    main()
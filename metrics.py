@@ -0,0 +1,358 @@
+import bisect
+import contextlib
+import multiprocessing
+import socket
+import struct
+import time
+
+# Rotas com métricas próprias (rótulo route="..." no /metrics)
+ROUTES = ("options", "health", "stats", "metrics", "name", "exact-name", "cpf", "batch-cpf",
+          "cnpj-name", "cnpj-name-cpf", "cnpj-radical", "invalid")
+
+# Where the time of a request goes: "query" is SQLite, the CPF index or the result
+# cache; "send" is writing to the socket; "serialize" is the rest (JSON, compression)
+PHASES = ("query", "serialize", "send")
+
+# Upper bounds in seconds, Prometheus style (each bucket counts observations <= bound)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Gauges that worker processes move up and down (see ServerMetrics.gauge)
+GAUGES = ("requests_in_flight", "connections_open", "connections_idle")
+
+
+class SharedCounters():
+    """Contadores em memória compartilhada, visíveis a todos os processos do servidor."""
+
+    def __init__(self, names, typecode='Q'):
+        self.names = tuple(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        # Created before forking so that every child process shares the same buffer.
+        # 'q' allows gauges that go down, 'd' accumulates seconds.
+        self._values = multiprocessing.Array(typecode, len(self.names))
+
+    def increment(self, name, amount=1):
+        with self._values.get_lock():
+            self._values[self._index[name]] += amount
+
+    def get(self, name):
+        return self._values[self._index[name]]
+
+    def snapshot(self):
+        with self._values.get_lock():
+            return dict(zip(self.names, self._values[:]))
+
+
+class SharedHistograms():
+    """Um histograma por rótulo, em memória compartilhada: contagem por faixa, total e soma."""
+
+    def __init__(self, labels, buckets=LATENCY_BUCKETS):
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._index = {label: i for i, label in enumerate(self.labels)}
+        # Per label: one slot per bucket plus +Inf, then count and sum
+        self._width = len(self.buckets) + 3
+        self._values = multiprocessing.Array('d', len(self.labels) * self._width)
+
+    def observe(self, label, value):
+        base = self._index[label] * self._width
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._values.get_lock():
+            self._values[base + slot] += 1
+            self._values[base + self._width - 2] += 1
+            self._values[base + self._width - 1] += value
+
+    def snapshot(self):
+        """{label: (cumulative counts per bucket including +Inf, count, sum)}"""
+        with self._values.get_lock():
+            values = self._values[:]
+        result = {}
+        for label, i in self._index.items():
+            row = values[i * self._width:(i + 1) * self._width]
+            cumulative, total = [], 0
+            for count in row[:-2]:
+                total += count
+                cumulative.append(int(total))
+            result[label] = (cumulative, int(row[-2]), row[-1])
+        return result
+
+
+class RequestTimer():
+    """Tempo, linhas e bytes de uma requisição, acumulados enquanto ela é atendida."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.route = "invalid"
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.rows = 0
+        self.bytes_sent = 0
+        self.elapsed = None
+        # TLS handshake of the connection, set only on its first request
+        self.handshake = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def iter_timed(self, batches):
+        """Wrap a stream_* generator so the time spent fetching each batch counts as query time."""
+        batches = iter(batches)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            finally:
+                self.phases["query"] += time.perf_counter() - start
+            self.rows += len(batch)
+            yield batch
+
+    def finish(self):
+        """Total elapsed time; whatever was not query or send time is counted as serialization."""
+        self.elapsed = time.perf_counter() - self.start
+        self.phases["serialize"] = max(0.0, self.elapsed - self.phases["query"] - self.phases["send"])
+        return self.elapsed
+
+    def server_timing(self):
+        """Server-Timing header value with the phases measured so far (durations in ms)."""
+        elapsed = time.perf_counter() - self.start
+        query, send = self.phases["query"], self.phases["send"]
+        timings = [("query", query), ("serialize", max(0.0, elapsed - query - send)), ("send", send),
+                   ("total", elapsed)]
+        if self.handshake is not None:
+            timings.insert(0, ("tls", self.handshake))
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings)
+
+
+class MeteredSocket():
+    """Socket (or async_server.StreamSink) wrapper that charges writes to a RequestTimer."""
+
+    def __init__(self, sock, timer):
+        self.sock = sock
+        self.timer = timer
+
+    def sendall(self, data):
+        start = time.perf_counter()
+        try:
+            self.sock.sendall(data)
+        finally:
+            self.timer.phases["send"] += time.perf_counter() - start
+        self.timer.bytes_sent += len(data)
+
+    def send(self, data):
+        start = time.perf_counter()
+        try:
+            sent = self.sock.send(data)
+        finally:
+            self.timer.phases["send"] += time.perf_counter() - start
+        self.timer.bytes_sent += sent
+        return sent
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def listen_queue(sock):
+    """
+    (connections waiting in the accept queue, backlog) of a listening socket,
+    from TCP_INFO. Linux only; None elsewhere or if the socket is gone.
+    """
+    if sock is None or not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except (OSError, ValueError):
+        return None
+    # For a listening socket tcpi_unacked is the accept queue length and tcpi_sacked its limit
+    _, _, _, _, unacked, sacked = struct.unpack_from("=8x6I", info)
+    return unacked, sacked
+
+
+class ServerMetrics():
+    """
+    Métricas do servidor no formato de exposição do Prometheus. Tudo fica em
+    memória compartilhada criada antes do fork, então qualquer processo que
+    atenda o /metrics enxerga os totais de todos os processos.
+    """
+
+    def __init__(self, capacity):
+        # Worker processes (prefork, reuseport), simultaneous connections (process) or query threads (asyncio)
+        self.capacity = capacity
+        self.latency = SharedHistograms(ROUTES)
+        # Time an accepted connection (process) or a read request (asyncio) waits for a free worker
+        self.accept_wait = SharedHistograms(("wait",), WAIT_BUCKETS)
+        self.totals = SharedCounters([f"{route}:{field}" for route in ROUTES
+                                      for field in ("bytes", "rows") + PHASES], 'd')
+        self.gauges = SharedCounters(GAUGES, 'q')
+        # Each holder's share of the gauges (a pool process, or a process-mode connection; see
+        # admission.AdmissionControl), taken back by holder_gone if the process dies without undoing it
+        self.held = SharedCounters([f"{holder}:{gauge}" for holder in range(capacity) for gauge in GAUGES], 'q')
+        # Per worker process (prefork and reuseport): pid, connections accepted and currently open
+        self.workers = SharedCounters([f"{slot}:{field}" for slot in range(capacity)
+                                       for field in ("pid", "accepted", "open")], 'q')
+        # Set by the Server once it is listening, to report the accept queue length (in reuseport
+        # mode each worker sets its own socket, so the value is that of the worker answering)
+        self.listen_socket = None
+
+    def observe(self, timer):
+        route = timer.route
+        self.latency.observe(route, timer.elapsed if timer.elapsed is not None else timer.finish())
+        for field, value in [("bytes", timer.bytes_sent), ("rows", timer.rows)] + list(timer.phases.items()):
+            if value:
+                self.totals.increment(f"{route}:{field}", value)
+
+    def gauge(self, name, amount=1, holder=None):
+        self.gauges.increment(name, amount)
+        if holder is not None:
+            self.held.increment(f"{holder}:{name}", amount)
+
+    def holder_gone(self, holder):
+        """Undo what a dead process left in the gauges. Call it before its holder is reused."""
+        values = self.held.snapshot()
+        for name in GAUGES:
+            left = values[f"{holder}:{name}"]
+            if left:
+                self.held.increment(f"{holder}:{name}", -left)
+                self.gauges.increment(name, -left)
+
+    def connection_opened(self, slot=None, holder=None):
+        self.gauge("connections_open", 1, holder)
+        if slot is not None:
+            self.workers.increment(f"{slot}:accepted")
+            self.workers.increment(f"{slot}:open")
+
+    def connection_closed(self, slot=None, holder=None):
+        self.gauge("connections_open", -1, holder)
+        if slot is not None:
+            self.workers.increment(f"{slot}:open", -1)
+
+    def worker_started(self, slot, pid):
+        # A respawned worker keeps its slot's accepted total; its predecessor's connections are gone
+        values = self.workers.snapshot()
+        self.workers.increment(f"{slot}:pid", pid - values[f"{slot}:pid"])
+        self.workers.increment(f"{slot}:open", -values[f"{slot}:open"])
+
+    def worker_connections(self):
+        """[{"worker", "pid", "accepted", "open"}] for every worker process started so far."""
+        values = self.workers.snapshot()
+        return [{"worker": slot, "pid": values[f"{slot}:pid"], "accepted": values[f"{slot}:accepted"],
+                 "open": values[f"{slot}:open"]}
+                for slot in range(self.capacity) if values[f"{slot}:pid"]]
+
+    def observe_wait(self, seconds):
+        self.accept_wait.observe("wait", max(0.0, seconds))
+
+    @staticmethod
+    def _labels(**labels):
+        return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}" if labels else ""
+
+    @staticmethod
+    def _number(value):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    def _histogram(self, lines, name, help_text, histograms, label_name=None):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        bounds = [self._number(bound) for bound in histograms.buckets] + ["+Inf"]
+        for label, (cumulative, count, total) in histograms.snapshot().items():
+            labels = {label_name: label} if label_name else {}
+            for bound, value in zip(bounds, cumulative):
+                lines.append(f"{name}_bucket{self._labels(**labels, le=bound)} {value}")
+            lines.append(f"{name}_sum{self._labels(**labels)} {self._number(total)}")
+            lines.append(f"{name}_count{self._labels(**labels)} {count}")
+
+    def _metric(self, lines, name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{self._labels(**labels)} {self._number(value)}")
+
+    def render(self, counters=None, cache_stats=None, admission=None):
+        """
+        The whole exposition text. counters is Server.stats.snapshot(), cache_stats
+        cache.QueryCache.stats() and admission admission.AdmissionControl.snapshot().
+        """
+        lines = []
+        latency = self.latency.snapshot()
+        totals = self.totals.snapshot()
+        gauges = self.gauges.snapshot()
+
+        self._metric(lines, "http_requests_total", "counter", "Requests answered, by route",
+                     [({"route": route}, latency[route][1]) for route in ROUTES])
+        self._histogram(lines, "http_request_duration_seconds", "Time to answer a request, by route",
+                        self.latency, "route")
+        self._metric(lines, "http_request_phase_seconds_total", "counter",
+                     "Request time by route and phase: query (SQLite, CPF index or result cache), "
+                     "serialize (JSON and compression) and send (socket writes)",
+                     [({"route": route, "phase": phase}, totals[f"{route}:{phase}"])
+                      for route in ROUTES for phase in PHASES])
+        self._metric(lines, "http_response_bytes_total", "counter", "Response bytes written, headers included",
+                     [({"route": route}, totals[f"{route}:bytes"]) for route in ROUTES])
+        self._metric(lines, "http_rows_returned_total", "counter", "Result rows returned, by route",
+                     [({"route": route}, totals[f"{route}:rows"]) for route in ROUTES])
+
+        self._metric(lines, "server_requests_in_flight", "gauge", "Requests being answered right now",
+                     [({}, gauges["requests_in_flight"])])
+        self._metric(lines, "server_connections_open", "gauge", "Client connections currently held by a worker",
+                     [({}, gauges["connections_open"])])
+        self._metric(lines, "server_connections_idle", "gauge",
+                     "Keep-alive connections waiting for their next request, closed if a new connection needs "
+                     "their worker", [({}, gauges["connections_idle"])])
+        self._metric(lines, "server_workers", "gauge",
+                     "Worker processes, simultaneous connections or query threads, depending on the mode",
+                     [({}, self.capacity)])
+        workers = self.worker_connections()
+        if workers:
+            self._metric(lines, "server_worker_connections_total", "counter",
+                         "Connections accepted by each worker process (prefork and reuseport)",
+                         [({"worker": w["worker"]}, w["accepted"]) for w in workers])
+            self._metric(lines, "server_worker_connections_open", "gauge", "Connections open in each worker process",
+                         [({"worker": w["worker"]}, w["open"]) for w in workers])
+        self._histogram(lines, "server_accept_queue_wait_seconds",
+                        "Time from accept (process mode) or from reading the request (asyncio) until a worker "
+                        "picks it up", self.accept_wait)
+        queue = listen_queue(self.listen_socket)
+        if queue is not None:
+            self._metric(lines, "server_accept_queue_length", "gauge",
+                         "Connections waiting in the kernel accept queue", [({}, queue[0])])
+            self._metric(lines, "server_accept_queue_limit", "gauge", "Accept queue limit (listen backlog)",
+                         [({}, queue[1])])
+
+        if counters:
+            if "tls_handshakes_full" in counters:
+                self._metric(lines, "tls_handshakes_total", "counter", "TLS handshakes, full or resumed",
+                             [({"type": "full"}, counters["tls_handshakes_full"]),
+                              ({"type": "resumed"}, counters["tls_handshakes_resumed"])])
+            if "response_bytes_raw" in counters:
+                self._metric(lines, "http_response_body_bytes_total", "counter",
+                             "Response body bytes before (raw) and after (sent) Content-Encoding",
+                             [({"stage": "raw"}, counters["response_bytes_raw"]),
+                              ({"stage": "sent"}, counters["response_bytes_sent"])])
+            if "connections_shed" in counters:
+                self._metric(lines, "server_connections_shed_total", "counter",
+                             "Connections refused with no free worker: answered 503 (shed) or closed (dropped)",
+                             [({"result": "shed"}, counters["connections_shed"]),
+                              ({"result": "dropped"}, counters["connections_dropped"])])
+        if admission:
+            for name, field, kind, help_text in [
+                    ("admission_running", "running", "gauge", "Requests holding a slot, by class"),
+                    ("admission_queue_depth", "waiting", "gauge", "Requests waiting for a slot, by class"),
+                    ("admission_slots", "slots", "gauge", "Slots per class"),
+                    ("admission_admitted_total", "admitted", "counter", "Requests admitted, by class"),
+                    ("admission_rejected_total", "rejected", "counter", "Requests answered 503, by class")]:
+                self._metric(lines, name, kind, help_text,
+                             [({"class": cls}, values[field]) for cls, values in admission.items()])
+        if cache_stats:
+            self._metric(lines, "cache_operations_total", "counter", "Result cache lookups and removals",
+                         [({"result": name}, cache_stats[name])
+                          for name in ("hits", "misses", "evictions", "expirations", "invalidations")])
+            self._metric(lines, "cache_entries", "gauge", "Entries in the result cache",
+                         [({}, cache_stats["entries"])])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,169 @@
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+import db
+
+# Varredura paralela ("scatter-gather"): uma consulta que percorre a tabela
+# inteira é dividida em faixas de rowid, cada faixa roda numa conexão só de
+# leitura de um pool de processos, e os resultados voltam na ordem das faixas
+# (a mesma ordem de uma varredura simples), enviados assim que as faixas
+# anteriores terminam. Só algumas faixas rodam por vez, e a próxima começa
+# quando uma termina, então a memória por requisição não cresce com a tabela. Processos daemon (os atendentes dos modos process,
+# prefork e reuseport) não podem ter filhos, então usam um pool de threads: o
+# SQLite libera o GIL enquanto varre, mas montar as linhas em Python não.
+
+# Tables with fewer rows than this per partition are scanned serially
+MIN_PARTITION_ROWS = 10000
+# Rowids per range at most: each range is fetched whole, and a scan holds one range per partition in flight
+MAX_PARTITION_ROWS = 20000
+
+_executors = {}
+_executors_lock = threading.Lock()
+# Connections of the pool processes/threads, one per database file
+_local = threading.local()
+
+
+def executor(workers, threads=None):
+    """
+    The pool of this process with workers workers: processes, or threads if
+    threads is true (by default, when this process is daemonic).
+    """
+    if threads is None:
+        threads = multiprocessing.current_process().daemon
+    kind = "thread" if threads else "process"
+    key = (os.getpid(), kind, workers)
+    with _executors_lock:
+        pool = _executors.get(key)
+        if pool is None:
+            if kind == "thread":
+                pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+            else:
+                # spawn: the server may already run threads (asyncio executor, log handlers), which fork does not copy
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                              mp_context=multiprocessing.get_context("spawn"))
+            _executors[key] = pool
+        return pool
+
+def shutdown():
+    """Stop the pools created by this process."""
+    with _executors_lock:
+        pools = [pool for (pid, _, _), pool in _executors.items() if pid == os.getpid()]
+        _executors.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _connection(path, db_options):
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = db.connect(path, **db_options)
+    return conn
+
+def scan_partition(path, db_options, sql, params, timeout=None):
+    """Run sql on one rowid range in a pool worker. Returns (columns, rows); timeout in seconds from now."""
+    conn = _connection(path, db_options)
+    if timeout:
+        deadline = time.monotonic() + timeout
+        conn.set_progress_handler(lambda: int(time.monotonic() > deadline), db.PROGRESS_STEPS)
+    try:
+        cursor = conn.execute(sql, params)
+        return [column[0] for column in cursor.description], cursor.fetchall()
+    finally:
+        if timeout:
+            conn.set_progress_handler(None, 0)
+
+
+class Scanner():
+    """
+    Divide varreduras completas de uma tabela em faixas de rowid e as executa
+    em paralelo. Um por Worker; guard é o db.QueryGuard do Worker, que dá o
+    tempo limite e detecta o cliente desconectado enquanto as faixas rodam.
+    """
+
+    def __init__(self, partitions, db_options=None, guard=None, threads=None):
+        self.partitions = partitions
+        self.db_options = db_options or {}
+        self.guard = guard
+        # Run the ranges in threads instead of processes; None decides by executor()'s rule
+        self.threads = threads
+
+    @staticmethod
+    def database_path(cursor):
+        for _, name, path in cursor.execute("PRAGMA database_list").fetchall():
+            if name == "main":
+                return path
+        return None
+
+    def ranges(self, cursor, table):
+        """
+        Split the rowids of table into (low, high) ranges for up to self.partitions
+        workers, none longer than MAX_PARTITION_ROWS. [] if not worth it.
+        """
+        # Two subqueries: SQLite only answers a lone MIN() or MAX() from the B-tree, both together scan the table
+        low, high = cursor.execute(f"SELECT (SELECT MIN(rowid) FROM {table}), "
+                                   f"(SELECT MAX(rowid) FROM {table})").fetchone()
+        if low is None:
+            return []
+        partitions = min(self.partitions, (high - low + 1) // MIN_PARTITION_ROWS)
+        if partitions < 2:
+            return []
+        step = min(-(-(high - low + 1) // partitions), MAX_PARTITION_ROWS)
+        return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+    def scan(self, cursor, table, sql, params):
+        """
+        Run sql (which must have a WHERE clause) on the rowid ranges of table,
+        self.partitions ranges at a time. Returns an iterator of (columns, rows),
+        one per range in rowid order, each yielded as soon as it and the ones
+        before it are done; or None if the table is too small to split (or in
+        memory), and the caller runs sql itself.
+        """
+        path = self.database_path(cursor)
+        ranges = self.ranges(cursor, table) if path else []
+        if not ranges:
+            return None
+        sql += " AND rowid BETWEEN ? AND ?"
+        timeout = None
+        if self.guard is not None and self.guard.deadline is not None:
+            timeout = max(0.001, self.guard.deadline - time.monotonic())
+        pool = executor(self.partitions, self.threads)
+        return self._gather(lambda bounds: pool.submit(scan_partition, path, self.db_options, sql,
+                                                       tuple(params) + bounds, timeout), ranges)
+
+    def _gather(self, submit, ranges):
+        ranges = iter(ranges)
+        pending = collections.deque(submit(bounds) for bounds in itertools.islice(ranges, self.partitions))
+        try:
+            while pending:
+                result = self._result(pending[0])
+                pending.popleft()
+                # Start the next range before handing this one over, so the workers stay busy
+                bounds = next(ranges, None)
+                if bounds is not None:
+                    pending.append(submit(bounds))
+                yield result
+        finally:
+            # Stopped early (error, timeout, client gone): drop the ranges that have not started
+            for future in pending:
+                future.cancel()
+
+    def _result(self, future):
+        while True:
+            try:
+                return future.result(timeout=db.PEER_CHECK_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                if self.guard is not None:
+                    self.guard.check()
+            except sqlite3.OperationalError as e:
+                # A range interrupted by its own deadline: the whole query ran out of time
+                if self.guard is not None and self.guard.timeout:
+                    raise db.QueryTimeout(self.guard.timeout) from e
+                raise
@@ -0,0 +1,71 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+# Perfil opcional das requisições: uma amostra aleatória, ou as requisições a
+# certas rotas, roda sob cProfile e vira um arquivo .pstats com a rota e a
+# duração no nome. Para ler: python -m pstats <arquivo> ou snakeviz <arquivo>.
+
+DEFAULT_DIRECTORY = "profiles"
+
+log = logging.getLogger("profiling")
+
+# Only one cProfile can be active per process (Python 3.12+ raises otherwise, older
+# versions mix the calls of every thread), so overlapping requests are not sampled
+_active = threading.Lock()
+
+
+class RequestProfiler():
+    """Decide which requests are profiled and write their .pstats files (one instance per worker)."""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, sample_rate=0.0, paths=(), min_ms=0.0):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        # Path prefixes that are always profiled, e.g. "/get-person-by-name/"
+        self.paths = tuple(paths)
+        # Requests faster than this are profiled but not written
+        self.min_ms = min_ms
+        os.makedirs(directory, exist_ok=True)
+
+    def wants(self, request):
+        if self.paths and request.path.startswith(self.paths):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @staticmethod
+    def start():
+        """A running cProfile.Profile, or None if this process is already profiling something."""
+        if not _active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is active (e.g. the whole server started under cProfile)
+            _active.release()
+            return None
+        return profile
+
+    def finish(self, profile, route, elapsed):
+        """Stop profile and write it if the request took at least min_ms. Returns the file path or None."""
+        try:
+            profile.disable()
+        finally:
+            _active.release()
+        ms = elapsed * 1000
+        if ms < self.min_ms:
+            return None
+        tag = re.sub(r"[^A-Za-z0-9-]", "_", route)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{tag}-{ms:.0f}ms.pstats"
+        path = os.path.join(self.directory, name)
+        try:
+            profile.dump_stats(path)
+        except OSError as e:
+            log.warning("Could not write profile %s: %s", path, e)
+            return None
+        log.info("Profile of a %s request (%.1fms) written to %s", route, ms, path)
+        return path
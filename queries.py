@@ -1,89 +1,336 @@
 import sqlite3
 import json
+import base64
 
-def search_cpf_by_exact_name(name, cursor):
+# Optional FTS5 trigram index over cpf.nome (see maintenance.py build-fts)
+CPF_NAME_FTS = "cpf_nome_fts"
+# Trigram indexes can only serve LIKE patterns with at least 3 characters
+FTS_MIN_LENGTH = 3
+# Rows fetched from the cursor (and sent to the client) at a time when streaming
+STREAM_BATCH_SIZE = 1000
+# CPFs per IN (...) list in the batch lookup, below SQLite's historical 999-parameter limit
+CPF_LOOKUP_CHUNK = 500
+
+class RowBatch(list):
+    """Rows straight from fetchmany (tuples, no per-row dict), with the column names alongside."""
+
+    def __init__(self, columns, rows=()):
+        super().__init__(rows)
+        self.columns = columns
+
+    def to_json(self):
+        return {'columns': self.columns, 'rows': self}
+
+def iter_batches(cursor, batch_size=STREAM_BATCH_SIZE, columnar=False):
+    """
+    Yield the rows of the last statement run on cursor as lists of dicts,
+    batch_size rows at a time. With columnar=True the batches are RowBatch
+    lists of tuples instead, and an empty result still yields one (empty)
+    batch so the column names are known.
+    """
+    columns = [column[0] for column in cursor.description]
+    first = True
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            if columnar and first:
+                yield RowBatch(columns)
+            break
+        first = False
+        yield RowBatch(columns, rows) if columnar else [dict(zip(columns, row)) for row in rows]
+
+def iter_partitions(partitions, batch_size=STREAM_BATCH_SIZE, columnar=False):
+    """
+    iter_batches for a parallel.Scanner scan: the (columns, rows) of each rowid
+    range, in order, cut into batches of batch_size rows.
+    """
+    def make(columns, rows):
+        return RowBatch(columns, rows) if columnar else [dict(zip(columns, row)) for row in rows]
+
+    columns, pending, empty = None, [], True
+    for columns, rows in partitions:
+        if pending:
+            rows = pending + rows
+        end = len(rows) - len(rows) % batch_size
+        for start in range(0, end, batch_size):
+            empty = False
+            yield make(columns, rows[start:start + batch_size])
+        pending = rows[end:]
+    if pending or (columnar and empty and columns is not None):
+        yield make(columns, pending)
+
+def fetch_all(batches):
+    return [row for batch in batches for row in batch]
+
+def fetch_columnar(batches):
+    """Collect RowBatch batches into one {"columns": [...], "rows": [...]} result."""
+    result = RowBatch([])
+    for batch in batches:
+        result.columns = batch.columns
+        result.extend(batch)
+    return result.to_json()
+
+def fetch(batches, columnar=False):
+    return fetch_columnar(batches) if columnar else fetch_all(batches)
+
+def result_size(result):
+    """Number of rows in a fetch() result, in either format."""
+    return len(result['rows']) if isinstance(result, dict) else len(result)
+
+# Column added to paginated queries for the page token; fetch_page drops it from the rows
+PAGE_ROWID = "page_rowid"
+
+def encode_page_token(row, columns=None):
+    """
+    Opaque token pointing right after row, for keyset pagination on (nome, cpf, rowid).
+    Columnar rows are tuples, so their columns must be given.
+    """
+    if columns is not None:
+        row = dict(zip(columns, row))
+    key = json.dumps([row['nome'], row['cpf'], row[PAGE_ROWID]], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(key).decode('ascii').rstrip('=')
+
+def decode_page_token(token):
+    """Returns the (nome, cpf, rowid) key stored by encode_page_token. Raises ValueError if malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid page token") from e
+    if (not isinstance(key, list) or len(key) != 3
+            or not isinstance(key[0], str) or not isinstance(key[1], str)
+            or type(key[2]) is not int or not -2**63 <= key[2] < 2**63):
+        # Bound as SQLite parameters: anything else fails inside the query instead of answering 400
+        raise ValueError("Invalid page token")
+    return key[0], key[1], key[2]
+
+def paginate(columns, sql, params, name_column, key_column, rowid_column, limit=None, after=None):
+    """
+    Build "SELECT columns sql" with keyset pagination: rows are ordered by
+    (nome, key, rowid) and a page starts right after the (nome, key, rowid) of
+    the previous page's last row. Neither nome nor (nome, key) is unique (one
+    partner per company, masked CPFs, repeated people), so the rowid breaks the
+    ties; paginated queries also select it as PAGE_ROWID for the token. The
+    bound is written as a range on nome, so an index on (nome COLLATE NOCASE,
+    key), which ends with the rowid, seeks straight to it and every page costs
+    the same as the first one.
+    """
+    if limit is None and after is None:
+        return f"SELECT {columns} {sql}", params
+    sql = f"SELECT {columns}, {rowid_column} AS {PAGE_ROWID} {sql}"
+    if after is not None:
+        sql += (f" AND {name_column} >= ? COLLATE NOCASE"
+                f" AND ({name_column} > ? COLLATE NOCASE OR {key_column} > ?"
+                f" OR ({key_column} = ? AND {rowid_column} > ?))")
+        params += (after[0], after[0], after[1], after[1], after[2])
+    sql += f" ORDER BY {name_column} COLLATE NOCASE, {key_column}, {rowid_column}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params += (limit,)
+    return sql, params
+
+def fetch_page(stream_func, args, cursor, limit, after=None, columnar=False):
+    """
+    Returns (rows, next_token) for one page of a stream_* query; next_token is None
+    on the last page. With columnar=True, rows is a {"columns", "rows"} dict.
+    """
+    batches = stream_func(*args, cursor, limit=limit + 1, after=after, columnar=columnar)
+    if columnar:
+        page = fetch_columnar(batches)
+        rows, columns = page['rows'], page['columns']
+    else:
+        page = rows = fetch_all(batches)
+        columns = None
+    next_token = None
+    if len(rows) > limit:
+        del rows[limit:]
+        next_token = encode_page_token(rows[-1], columns)
+    # The rowid is only there for the token
+    if columnar:
+        page['columns'] = columns[:-1]
+        rows[:] = [row[:-1] for row in rows]
+    else:
+        for row in rows:
+            del row[PAGE_ROWID]
+    return page, next_token
+
+def has_table(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def stream_cpf_by_exact_name(name, cursor, batch_size=STREAM_BATCH_SIZE, limit=None, after=None, columnar=False):
+    # Seeks on idx_cpf_nome, which is declared with the same NOCASE collation
     name = name.upper()
-    cursor.execute(
-        "SELECT cpf, nome, sexo, nasc FROM cpf WHERE nome = ? COLLATE NOCASE",
-        (name,)
-    )
-    result = cursor.fetchall()
-    json_result = []
-    for row in result:
-        json_dict = {
-            'cpf': row[0],
-            'nome': row[1],
-            'sexo': row[2],
-            'nasc': row[3]
-        }
-        json_result.append(json_dict)
-    return json_result
-
-def search_cpf_by_name(name, cursor):
+    cursor.execute(*paginate(
+        "cpf, nome, sexo, nasc", "FROM cpf WHERE nome = ? COLLATE NOCASE",
+        (name,),
+        "nome", "cpf", "rowid", limit, after
+    ))
+    yield from iter_batches(cursor, batch_size, columnar)
+
+def search_cpf_by_exact_name(name, cursor, columnar=False):
+    return fetch(stream_cpf_by_exact_name(name, cursor, columnar=columnar), columnar)
+
+def scan(scanner, cursor, table, sql, params, batch_size, columnar):
+    """
+    Batches of a full table scan (an unpaginated sql with a WHERE clause), split
+    across rowid ranges by scanner (a parallel.Scanner) if given and worthwhile.
+    Split scans return rows in rowid order, which may differ from the order of
+    the serial plan (e.g. socios is scanned through its covering nome index).
+    """
+    partitions = scanner.scan(cursor, table, sql, params) if scanner is not None else None
+    if partitions is not None:
+        return iter_partitions(partitions, batch_size, columnar)
+    cursor.execute(sql, params)
+    return iter_batches(cursor, batch_size, columnar)
+
+def stream_cpf_by_name(name, cursor, batch_size=STREAM_BATCH_SIZE, limit=None, after=None, columnar=False,
+                       scanner=None):
     name = name.upper()
-    cursor.execute(
-        "SELECT cpf, nome, sexo, nasc FROM cpf WHERE nome LIKE ?",
-        ('%' + name + '%',)
-    )
-    result = cursor.fetchall()
-    json_result = []
-    for row in result:
-        json_dict = {
-            'cpf': row[0],
-            'nome': row[1],
-            'sexo': row[2],
-            'nasc': row[3]
-        }
-        json_result.append(json_dict)
-    return json_result
-
-def search_cpf_by_cpf(cpf, cursor):
+    if len(name) >= FTS_MIN_LENGTH and has_table(cursor, CPF_NAME_FTS):
+        # The trigram index narrows down the candidate rows; checking c.nome again
+        # keeps the result identical to the plain LIKE scan below
+        cursor.execute(*paginate(
+            "c.cpf, c.nome, c.sexo, c.nasc",
+            f"FROM {CPF_NAME_FTS} f JOIN cpf c ON c.rowid = f.rowid WHERE f.nome LIKE ? AND c.nome LIKE ?",
+            ('%' + name + '%', '%' + name + '%'),
+            "c.nome", "c.cpf", "c.rowid", limit, after
+        ))
+    elif limit is None and after is None:
+        # Full scan, split across the scanner's workers when there is one
+        yield from scan(scanner, cursor, "cpf", "SELECT cpf, nome, sexo, nasc FROM cpf WHERE nome LIKE ?",
+                        ('%' + name + '%',), batch_size, columnar)
+        return
+    else:
+        # When paginated, walks idx_cpf_nome in order and stops after the page
+        cursor.execute(*paginate(
+            "cpf, nome, sexo, nasc", "FROM cpf WHERE nome LIKE ?",
+            ('%' + name + '%',),
+            "nome", "cpf", "rowid", limit, after
+        ))
+    yield from iter_batches(cursor, batch_size, columnar)
+
+def search_cpf_by_name(name, cursor, columnar=False, scanner=None):
+    return fetch(stream_cpf_by_name(name, cursor, columnar=columnar, scanner=scanner), columnar)
+
+def stream_cpf_by_cpf(cpf, cursor, batch_size=STREAM_BATCH_SIZE, columnar=False):
     cursor.execute(
         "SELECT cpf, nome, sexo, nasc FROM cpf WHERE cpf = ?",
         (cpf,)
     )
-    result = cursor.fetchall()
-    json_result = []
-    for row in result:
-        json_dict = {
-            'cpf': row[0],
-            'nome': row[1],
-            'sexo': row[2],
-            'nasc': row[3]
-        }
-        json_result.append(json_dict)
-    return json_result
-
-def check_person_cnpj(name, cursor):
-    cursor.execute(
-        "SELECT cpf_cnpj, nome, sexo, nasc FROM socios WHERE nome LIKE ?",
-        ('%' + name + '%',)
-    )
-    result = cursor.fetchall()
-    json_result = []
-    for row in result:
-        json_dict = {
-            'cpf': row[0],
-            'nome': row[1],
-            'sexo': row[2],
-            'nasc': row[3]
-        }
-        json_result.append(json_dict)
-    return json_result
-
-def check_person_cnpj_and_cpf(name_and_cpf, cursor):
-    name = name_and_cpf[:-6]
-    cpf = name_and_cpf[-6:]
+    yield from iter_batches(cursor, batch_size, columnar)
+
+def search_cpf_by_cpf(cpf, cursor, columnar=False):
+    return fetch(stream_cpf_by_cpf(cpf, cursor, columnar=columnar), columnar)
+
+def stream_cpfs_by_cpf(cpfs, cursor, chunk_size=CPF_LOOKUP_CHUNK):
+    """
+    Bulk version of stream_cpf_by_cpf: looks the CPFs up chunk_size at a time with
+    one IN (...) query per chunk (each one a set of idx_cpf_cpf seeks) and yields
+    one list per chunk, in input order. CPFs that are not in the database come
+    back as {"cpf": ..., "found": False}.
+    """
+    for start in range(0, len(cpfs), chunk_size):
+        chunk = cpfs[start:start + chunk_size]
+        unique = list(dict.fromkeys(chunk))
+        cursor.execute(
+            f"SELECT cpf, nome, sexo, nasc FROM cpf WHERE cpf IN ({','.join('?' * len(unique))})",
+            unique
+        )
+        found = {}
+        for batch in iter_batches(cursor):
+            for row in batch:
+                found.setdefault(row['cpf'], []).append(row)
+        results = []
+        for cpf in chunk:
+            rows = found.get(cpf)
+            if rows:
+                results.extend(dict(row, found=True) for row in rows)
+            else:
+                results.append({'cpf': cpf, 'found': False})
+        yield results
+
+def stream_person_cnpj(name, cursor, batch_size=STREAM_BATCH_SIZE, limit=None, after=None, columnar=False,
+                       scanner=None):
+    # socios has no sexo/nasc columns: only the partner's (masked) CPF and name
+    if limit is None and after is None:
+        yield from scan(scanner, cursor, "socios", "SELECT cpf_cnpj AS cpf, nome FROM socios WHERE nome LIKE ?",
+                        ('%' + name + '%',), batch_size, columnar)
+        return
+    cursor.execute(*paginate(
+        "cpf_cnpj AS cpf, nome", "FROM socios WHERE nome LIKE ?",
+        ('%' + name + '%',),
+        "nome", "cpf_cnpj", "rowid", limit, after
+    ))
+    yield from iter_batches(cursor, batch_size, columnar)
+
+def check_person_cnpj(name, cursor, columnar=False, scanner=None):
+    return fetch(stream_person_cnpj(name, cursor, columnar=columnar, scanner=scanner), columnar)
+
+def mask_cpf(cpf):
+    """socios stores partner CPFs masked as ***XXXXXX**, keeping only digits 4 to 9."""
+    return '***' + cpf[3:9] + '**'
+
+def group_companies(rows):
+    """
+    Fold the rows of stream_partner_companies (ordered by radical) into one dict
+    per company, with its partner entry and its establishments nested inside.
+    Rows arrive in batches, so a company may span two of them.
+    """
+    company = None
+    for row in rows:
+        if company is None or company['radical'] != row['radical']:
+            if company is not None:
+                yield company
+            company = {
+                'radical': row['radical'],
+                'razao': row['razao'],
+                'socio': {'nome': row['nome'], 'cpf': row['cpf'],
+                          'qualificacao': row['qualificacao'], 'data': row['data']},
+                'estabelecimentos': [],
+            }
+        if row.get('ordem') is not None:
+            company['estabelecimentos'].append({
+                'cnpj': row['radical'] + row['ordem'] + row['dv'],
+                'matriz_filial': row['matriz_filial'],
+                'nome_fantasia': row['nome_fantasia'],
+                'situacao': row['situacao'],
+                'logradouro': ' '.join(filter(None, (row['tipo_logradouro'], row['logradouro']))),
+                'numero': row['numero'],
+                'municipio': row['municipio'],
+                'uf': row['uf'],
+            })
+    if company is not None:
+        yield company
+
+def stream_partner_companies(name, cpf, cursor, batch_size=STREAM_BATCH_SIZE, exact=False, establishments=True):
+    """
+    Companies where the person (name + CPF) is a partner, in a single query:
+    socios is filtered through idx_socios_cpf_cnpj and joined to empresas and
+    estabelecimentos through their radical indexes. Yields lists of nested
+    company dicts (see group_companies).
+    """
+    columns = ("s.radical, s.nome, s.cpf_cnpj AS cpf, s.qualificacao, s.data, e.razao")
+    joins = "LEFT JOIN empresas e ON e.radical = s.radical"
+    order = "s.radical"
+    if establishments:
+        columns += (", est.ordem, est.dv, est.matriz_filial, est.nome_fantasia, est.situacao,"
+                    " est.tipo_logradouro, est.logradouro, est.numero, est.municipio, est.UF AS uf")
+        joins += " LEFT JOIN estabelecimentos est ON est.radical = s.radical"
+        order += ", est.ordem"
     cursor.execute(
-        "SELECT cpf_cnpj, nome FROM socios WHERE nome LIKE ? AND cpf_cnpj LIKE ?",
-        (name, '%' + cpf + '%',)
+        f"SELECT {columns} FROM socios s {joins}"
+        f" WHERE s.cpf_cnpj = ? AND s.nome LIKE ? ORDER BY {order}",
+        (mask_cpf(cpf), name if exact else '%' + name + '%')
     )
-    result = cursor.fetchall()
-    json_result = []
-    for row in result:
-        json_dict = {
-            'cpf': row[0],
-            'nome': row[1]
-        }
-        json_result.append(json_dict)
-    return json_result
+    rows = (row for batch in iter_batches(cursor, batch_size) for row in batch)
+    batch = []
+    for company in group_companies(rows):
+        batch.append(company)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def search_partner_companies(name, cpf, cursor, exact=False, establishments=True):
+    return fetch_all(stream_partner_companies(name, cpf, cursor, exact=exact, establishments=establishments))
@@ -1,19 +1,870 @@
-import sqlite3
+import admission
+import concurrent.futures
+import functools
 import json
+import logging
 import queries
+import metrics
+import parallel
+import cache
+import logs
+import profiling
+import cpf_index
+import db
 import socket
+import sqlite3
+import threading
 import multiprocessing
+import multiprocessing.connection
 import re
 import select
 import urllib.parse
 import ssl
-import traceback
 import time
+import zlib
 from datetime import datetime, timedelta
 
+log = logging.getLogger("server")
+request_log = logging.getLogger(logs.REQUEST_LOGGER)
+
+# Limits for persistent (keep-alive) connections
+KEEPALIVE_TIMEOUT = 5.0
+MAX_KEEPALIVE_REQUESTS = 100
+# How often an idle keep-alive connection checks whether a new connection needs its worker,
+# and how long the process-mode accept loop waits for one it asked to close
+IDLE_POLL_INTERVAL = 0.05
+IDLE_RECLAIM_TIMEOUT = 1.0
+MAX_HEADER_SIZE = 65536
+MAX_BODY_SIZE = 4 * 1024 * 1024
+# Page sizes for the ?limit=&after= keyset pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# CPFs accepted by one POST /get-persons-by-cpf
+MAX_BATCH_CPFS = 100000
+# Query time budget per route, in seconds (see db.QueryGuard). For streamed
+# responses the budget applies to each batch, not to the whole stream.
+QUERY_TIMEOUTS = {
+    "cpf": 5.0,
+    "batch-cpf": 30.0,
+    "exact-name": 10.0,
+    "name": 30.0,
+    "cnpj-name": 30.0,
+    "cnpj-name-cpf": 10.0,
+    "cnpj-radical": 10.0,
+}
+DEFAULT_QUERY_TIMEOUT = 30.0
+# Process mode: connections that find every slot taken are answered 503 by a few
+# threads of the accept process; beyond MAX_SHED_PENDING they are just closed
+SHED_THREADS = 2
+MAX_SHED_PENDING = 64
+SHED_TIMEOUT = 2.0
+# Responses smaller than this are sent uncompressed even if the client accepts gzip/deflate
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+# Accept media type that selects the {"columns": [...], "rows": [[...]]} result format
+COLUMNAR_MEDIA_TYPE = "application/x-columnar+json"
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Request():
+    """Requisição HTTP já separada em linha de requisição, cabeçalhos e corpo."""
+
+    def __init__(self, method, target, version, headers, body=b""):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+        path, _, query = target.partition("?")
+        self.path = path
+        self.query = dict(urllib.parse.parse_qsl(query))
+
+    @property
+    def line(self):
+        return f"{self.method} {self.target} {self.version}"
+
+    @property
+    def content_length(self):
+        try:
+            length = int(self.headers.get("content-length", 0))
+        except ValueError:
+            raise BadRequest("Invalid Content-Length")
+        if not 0 <= length <= MAX_BODY_SIZE:
+            raise BadRequest(f"Content-Length must be between 0 and {MAX_BODY_SIZE}")
+        return length
+
+    @property
+    def wants_stream(self):
+        # Opt-in incremental streaming: ?stream=1 or Accept: application/x-ndjson
+        return (self.query.get("stream") in ("1", "true")
+                or "application/x-ndjson" in self.headers.get("accept", ""))
+
+    @property
+    def accept_encoding(self):
+        """The Content-Encoding to answer with (gzip, deflate or None), from the Accept-Encoding header."""
+        return Compressor.negotiate(self.headers.get("accept-encoding", ""))
+
+    @property
+    def columnar(self):
+        # Opt-in compact format: ?format=columnar or Accept: application/x-columnar+json
+        return (self.query.get("format") == "columnar"
+                or COLUMNAR_MEDIA_TYPE in self.headers.get("accept", ""))
+
+    @property
+    def paginated(self):
+        return "limit" in self.query or "after" in self.query
+
+    def page(self):
+        """Returns (limit, after) from ?limit=&after=; after is the decoded keyset cursor or None."""
+        try:
+            limit = int(self.query.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise BadRequest("Invalid limit")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise BadRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        after = self.query.get("after")
+        if after:
+            try:
+                after = queries.decode_page_token(after)
+            except ValueError as e:
+                raise BadRequest(str(e))
+        return limit, after or None
+
+    def cpf_list(self):
+        """
+        CPFs from the body of a batch lookup: a JSON array, or CPFs separated by
+        newlines or commas (the format written by random_cpf_generator.py).
+        Formatting characters are dropped, so 123.456.789-09 is accepted; entries
+        without any digit are rejected.
+        """
+        try:
+            text = self.body.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            raise BadRequest("Body must be UTF-8")
+        if text.startswith(("[", "{")):
+            try:
+                values = json.loads(text)
+            except ValueError:
+                raise BadRequest("Invalid JSON body")
+            if not isinstance(values, list) or not all(isinstance(value, (str, int)) for value in values):
+                raise BadRequest("The JSON body must be an array of CPFs")
+        else:
+            values = re.split(r"[\s,]+", text)
+        cpfs = []
+        for value in values:
+            if not str(value).strip():
+                continue
+            cpf = re.sub(r"\D", "", str(value))
+            if not cpf:
+                raise BadRequest(f"Invalid CPF: {str(value)[:50]!r}")
+            cpfs.append(cpf)
+        if not cpfs:
+            raise BadRequest("No CPFs in the request body")
+        if len(cpfs) > MAX_BATCH_CPFS:
+            raise BadRequest(f"At most {MAX_BATCH_CPFS} CPFs per request")
+        return cpfs
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    @staticmethod
+    def parse_head(head):
+        # head: request line and headers, without the final blank line
+        lines = head.decode("iso-8859-1").split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3 or not re.match(r"HTTP/1\.[01]$", parts[2]):
+            raise BadRequest(f"Malformed request line: {lines[0]!r}")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise BadRequest(f"Malformed header: {line!r}")
+            headers[name.strip().lower()] = value.strip()
+        return Request(parts[0], parts[1], parts[2], headers)
+
+
+class Compressor():
+    """
+    Content-Encoding negociado para uma resposta. Corpos completos são comprimidos
+    de uma vez (se passarem de COMPRESS_MIN_SIZE); no streaming, cada chunk passa
+    pelo mesmo compressor zlib com Z_SYNC_FLUSH, para que o cliente possa
+    descomprimir cada mensagem assim que ela chega.
+
+    Os bytes antes e depois da compressão vão para os contadores do servidor.
+    """
+
+    # gzip wraps the deflate stream in a gzip header; HTTP "deflate" is the zlib format
+    WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+    def __init__(self, encoding=None, stats=None):
+        self.encoding = encoding
+        self.stats = stats
+        self._zlib = None
+
+    @staticmethod
+    def negotiate(accept_encoding):
+        """Pick gzip or deflate from an Accept-Encoding header, honouring q-values. None means identity."""
+        weights = {}
+        for item in accept_encoding.split(","):
+            name, *params = [part.strip() for part in item.split(";")]
+            q = 1.0
+            for param in params:
+                key, _, value = param.partition("=")
+                if key.strip() == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            weights[name.lower()] = q
+        best = None
+        for encoding in ("gzip", "deflate"):
+            q = weights.get(encoding, weights.get("*", 0.0))
+            if q > 0 and (best is None or q > best[1]):
+                best = (encoding, q)
+        return best[0] if best else None
+
+    @property
+    def header(self):
+        return f"Content-Encoding: {self.encoding}\r\nVary: Accept-Encoding\r\n" if self.encoding else ""
+
+    def _count(self, raw, sent):
+        if self.stats:
+            self.stats.increment("response_bytes_raw", raw)
+            self.stats.increment("response_bytes_sent", sent)
+
+    def body(self, data):
+        """Encode a complete body. Small bodies are left as they are (and header becomes empty)."""
+        if self.encoding and len(data) < COMPRESS_MIN_SIZE:
+            self.encoding = None
+        encoded = data
+        if self.encoding:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, self.WBITS[self.encoding])
+            encoded = compressor.compress(data) + compressor.flush()
+        self._count(len(data), len(encoded))
+        return encoded
+
+    def chunk(self, data):
+        """Encode one piece of a streamed body; the output may be empty."""
+        encoded = data
+        if self.encoding:
+            if self._zlib is None:
+                self._zlib = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, self.WBITS[self.encoding])
+            encoded = self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        self._count(len(data), len(encoded))
+        return encoded
+
+    def finish(self):
+        """Trailing bytes of a streamed body (the end of the deflate stream and the gzip trailer)."""
+        if not self.encoding:
+            return b""
+        if self._zlib is None:
+            self._zlib = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, self.WBITS[self.encoding])
+        encoded = self._zlib.flush()
+        self._count(0, len(encoded))
+        return encoded
+
+
+class Worker():
+    """Estado de um processo atendente: contexto SSL e conexões com os bancos."""
+
+    def __init__(self, cpf_db, cnpj_db, context=None, stats=None,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, max_requests=MAX_KEEPALIVE_REQUESTS, cache=None,
+                 db_options=None, cpf_index_path=None, server_metrics=None, profiler=None, query_timeout=None,
+                 admission_control=None, scan_partitions=None):
+        self.cpf_db = cpf_db
+        self.cnpj_db = cnpj_db
+        # Shared SSL context built once by the Server, before forking
+        self.context = context
+        self.stats = stats
+        # Proxy to the shared cache.QueryCache, or None when caching is disabled
+        self.cache = cache
+        # Keyword arguments for db.connect (mmap_size, cache_size, temp_store, immutable)
+        self.db_options = db_options or {}
+        # Optional memory-mapped CPF index (cpf_index.py); None until open() finds a valid one
+        self.cpf_index_path = cpf_index_path or cpf_index.default_path(cpf_db)
+        self.cpf_index = None
+        self.cpf_index_checked = False
+        # metrics.ServerMetrics shared by every process, and the timer of the request being answered
+        self.metrics = server_metrics
+        self.timer = metrics.RequestTimer()
+        # Optional profiling.RequestProfiler, and the handshake time waiting for the connection's first request
+        self.profiler = profiler
+        self.handshake_time = None
+        # One budget for every route instead of QUERY_TIMEOUTS (0 disables the limit)
+        self.query_timeout = query_timeout
+        self.guard = db.QueryGuard()
+        # Shared admission.AdmissionControl, and the class whose slot the current request holds
+        self.admission = admission_control
+        self.admitted = None
+        # Index of this worker process in the pool (prefork and reuseport), for per-process metrics
+        self.slot = None
+        # Index of this process's entry in the shared admission and gauge state: its pool slot, or the
+        # connection's in process mode. The Server clears the entry if the process dies
+        self.holder = None
+        # Pool modes: the socket this worker accepts on, and whether other workers accept on it too
+        # (prefork) or it is this worker's own (reuseport). Watched while a keep-alive connection is idle
+        self.listen_socket = None
+        self.listen_shared = True
+        # Splits the full-scan searches (name, cnpj-name) into rowid ranges run in parallel
+        self.scanner = None
+        if scan_partitions and scan_partitions > 1:
+            self.scanner = parallel.Scanner(scan_partitions, self.db_options, self.guard)
+        self.keepalive_timeout = keepalive_timeout
+        self.max_requests = max_requests
+        self.conn_cpf = None
+        self.conn_cnpj = None
+        self.cursor_cpf = None
+        self.cursor_cnpj = None
+
+    def open(self):
+        if self.context is None:
+            self.context = Server.create_ssl_context()
+        if self.conn_cpf is None:
+            self.conn_cpf = db.connect(self.cpf_db, **self.db_options)
+            self.guard.install(self.conn_cpf)
+            self.cursor_cpf = self.conn_cpf.cursor()
+        if self.conn_cnpj is None:
+            self.conn_cnpj = db.connect(self.cnpj_db, **self.db_options)
+            self.guard.install(self.conn_cnpj)
+            self.cursor_cnpj = self.conn_cnpj.cursor()
+        if not self.cpf_index_checked:
+            # Checked once per worker: a missing or stale index is not looked for again on every connection
+            self.cpf_index = cpf_index.load(self.cpf_index_path, self.cpf_db)
+            self.cpf_index_checked = True
+
+    def close(self):
+        for conn in (self.conn_cpf, self.conn_cnpj):
+            if conn:
+                try:
+                    conn.close()
+                except:
+                    pass
+        self.conn_cpf = self.conn_cnpj = None
+        self.cursor_cpf = self.cursor_cnpj = None
+        if self.cpf_index is not None:
+            self.cpf_index.close()
+            self.cpf_index = None
+        self.cpf_index_checked = False
+
+    @staticmethod
+    def read_request(sock, buffer):
+        """
+        Read one request from sock. Bytes received past its end stay in buffer,
+        so pipelined requests that arrived in the same read are not lost.
+
+        Returns None if the peer closed the connection between requests.
+        """
+        while True:
+            end = buffer.find(b"\r\n\r\n")
+            if end != -1:
+                break
+            if len(buffer) > MAX_HEADER_SIZE:
+                raise BadRequest("Request headers too large")
+            data = sock.recv(8192)
+            if not data:
+                if buffer:
+                    raise BadRequest("Connection closed in the middle of a request")
+                return None
+            buffer += data
+
+        request = Request.parse_head(bytes(buffer[:end]))
+        del buffer[:end + 4]
+
+        length = request.content_length
+        while len(buffer) < length:
+            data = sock.recv(8192)
+            if not data:
+                raise BadRequest("Connection closed in the middle of a request")
+            buffer += data
+        request.body = bytes(buffer[:length])
+        del buffer[:length]
+        return request
+
+    def handle_connection(self, client_socket, addr):
+        ssl_socket = None
+        counted = False
+
+        try:
+            if self.context is None:
+                self.context = Server.create_ssl_context()
+
+            # Wrap the socket with SSL
+            try:
+                handshake_start = time.perf_counter()
+                ssl_socket = self.context.wrap_socket(client_socket, server_side=True)
+                self.handshake_time = time.perf_counter() - handshake_start
+                resumed = ssl_socket.session_reused
+                if self.stats:
+                    self.stats.increment("tls_handshakes_resumed" if resumed else "tls_handshakes_full")
+                log.debug("SSL handshake successful with %s (%s)", addr, "resumed" if resumed else "full")
+                if self.metrics:
+                    self.metrics.connection_opened(self.slot, self.holder)
+                    counted = True
+            except ssl.SSLError as e:
+                log.info("SSL handshake failed with %s: %s", addr, e)
+                return
+            except Exception as e:
+                log.error("Error during SSL wrap: %s", e)
+                return
+
+            # Open database connections (no-op if already open)
+            self.open()
+
+            # Serve requests until the client closes, goes idle or hits the limit
+            buffer = bytearray()
+            handled = 0
+            while handled < self.max_requests:
+                if handled and not buffer and not ssl_socket.pending() and not self.wait_for_request(ssl_socket):
+                    break
+                ssl_socket.settimeout(self.keepalive_timeout)
+                try:
+                    request = self.read_request(ssl_socket, buffer)
+                except socket.timeout:
+                    if handled == 0:
+                        log.debug("No data received from %s", addr)
+                    break
+                except BadRequest as e:
+                    log.info("Bad request from %s: %s", addr, e)
+                    Server.send_http_json(ssl_socket, {"error": "Invalid request"}, status="400 Bad Request")
+                    break
+                if request is None:
+                    if handled == 0:
+                        log.debug("No data received from %s", addr)
+                    break
+
+                handled += 1
+                keep_alive = request.keep_alive and handled < self.max_requests
+                if not self.handle_request(ssl_socket, request, keep_alive):
+                    break
+        except Exception as e:
+            log.exception("Error handling client %s: %s", addr, e)
+        finally:
+            if counted:
+                self.metrics.connection_closed(self.slot, self.holder)
+
+            # Close sockets
+            if ssl_socket:
+                try:
+                    ssl_socket.close()
+                except:
+                    pass
+
+            try:
+                client_socket.close()
+            except:
+                pass
+
+            log.debug("Connection with %s closed", addr)
+
+    def wait_for_request(self, ssl_socket):
+        """
+        Wait for the next request on an idle keep-alive connection. Returns False
+        to close it: keepalive_timeout passed, or a new connection needs this
+        worker (one waiting in its accept queue with no other worker accepting, or
+        in process mode the accept loop found every slot taken).
+        """
+        if self.admission is None or self.holder is None:
+            # read_request waits with the keep-alive timeout
+            return True
+        deadline = time.monotonic() + self.keepalive_timeout
+        state = admission.IDLE
+        self.admission.set_state(self.holder, state)
+        if self.metrics:
+            self.metrics.gauge("connections_idle", 1, self.holder)
+        watch_listener = self.listen_socket is not None
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                sockets = [ssl_socket, self.listen_socket] if watch_listener else [ssl_socket]
+                readable, _, _ = select.select(sockets, [], [], min(remaining, IDLE_POLL_INTERVAL))
+                if ssl_socket in readable:
+                    return True
+                if self.admission.reclaimed(self.holder):
+                    log.debug("Closing an idle connection: every slot is taken")
+                    return False
+                watch_listener = self.listen_socket is not None
+                if self.listen_socket in readable:
+                    # Only this worker accepts on a reuseport socket; a shared one may have a free worker
+                    if not self.listen_shared:
+                        return False
+                    if self.admission.claim_idle(self.holder):
+                        state = admission.ACCEPTING
+                        log.debug("Closing an idle connection: a new one is waiting")
+                        return False
+                    # Another worker is about to accept it: only watch the connection for one interval
+                    watch_listener = False
+        finally:
+            if state == admission.IDLE:
+                self.admission.set_state(self.holder, admission.ACTIVE)
+            if self.metrics:
+                self.metrics.gauge("connections_idle", -1, self.holder)
+
+    def handle_request(self, ssl_socket, request, keep_alive=False):
+        """Answer one request. Returns True if the connection can serve another one."""
+        self.timer = metrics.RequestTimer()
+        self.timer.handshake, self.handshake_time = self.handshake_time, None
+        ssl_socket = metrics.MeteredSocket(ssl_socket, self.timer)
+        if self.metrics:
+            self.metrics.gauge("requests_in_flight", 1, self.holder)
+        profile = None
+        # Queries are cut short if the client goes away; set_route() adds the time budget
+        self.guard.arm(None, functools.partial(Server.peer_closed, ssl_socket))
+        try:
+            if self.profiler and self.profiler.wants(request):
+                profile = self.profiler.start()
+            return self.route(ssl_socket, request, keep_alive)
+        except BadRequest as e:
+            log.info("Bad request: %s", e)
+            return Server.send_http_json(ssl_socket, {"error": str(e)}, status="400 Bad Request",
+                                         keep_alive=keep_alive)
+        except db.QueryTimeout as e:
+            log.warning("%s %s: %s", request.method, request.path, e)
+            return Server.send_http_json(ssl_socket, {"error": str(e), "timeout": e.timeout},
+                                         status="504 Gateway Timeout", keep_alive=keep_alive)
+        except db.ClientDisconnected as e:
+            log.info("%s %s: %s", request.method, request.path, e)
+            return False
+        except admission.Overloaded as e:
+            log.info("%s %s: %s", request.method, request.path, e)
+            # Close the connection too, so an idle keep-alive does not hold a worker during overload
+            return Server.send_unavailable(ssl_socket, e)
+        finally:
+            self.guard.disarm()
+            if self.admitted:
+                self.admission.release(self.admitted, self.holder)
+                self.admitted = None
+            self.timer.finish()
+            if profile:
+                self.profiler.finish(profile, self.timer.route, self.timer.elapsed)
+            if self.metrics:
+                self.metrics.gauge("requests_in_flight", -1, self.holder)
+                self.metrics.observe(self.timer)
+            self.log_request(request)
+
+    def log_request(self, request):
+        # One access line per request, sampled by logs.SampleFilter
+        if request_log.isEnabledFor(logging.INFO):
+            timer = self.timer
+            request_log.info("%s %s %s %.1fms %dB %d rows", request.method, request.path, timer.route,
+                             timer.elapsed * 1000, timer.bytes_sent, timer.rows,
+                             extra={"method": request.method, "path": request.path, "route": timer.route,
+                                    "ms": round(timer.elapsed * 1000, 3), "bytes": timer.bytes_sent,
+                                    "rows": timer.rows})
+
+    @staticmethod
+    def cache_key(route, params):
+        # The cpf queries upper-case the name, so there "Silva" and "SILVA" share an entry. The cnpj-* queries pass
+        # it to LIKE as given, which only folds ASCII ("joão" and "JOÃO" differ), so they key on it unchanged
+        if route.startswith("cnpj-"):
+            return (route,) + tuple(params)
+        return (route,) + tuple(p.upper() if isinstance(p, str) else p for p in params)
+
+    @staticmethod
+    def partner_params(name, cpf):
+        """Decode the <name>-<cpf> part of the CNPJ partner routes. The CPF may be formatted (123.456.789-09)."""
+        name = urllib.parse.unquote_plus(name)
+        cpf = re.sub(r"\D", "", urllib.parse.unquote_plus(cpf))
+        if len(cpf) != 11:
+            raise BadRequest("CPF must have 11 digits")
+        return name, cpf
+
+    def set_route(self, route):
+        self.timer.route = route
+        if self.admission is not None:
+            # Raises admission.Overloaded when the route's class is full
+            request_class = admission.route_class(route)
+            self.admission.acquire(request_class, self.holder)
+            self.admitted = request_class
+        timeout = self.query_timeout
+        if timeout is None:
+            timeout = QUERY_TIMEOUTS.get(route, DEFAULT_QUERY_TIMEOUT)
+        self.guard.arm(timeout, self.guard.peer_closed)
+
+    def run_query(self, compute):
+        """compute() under the route's time budget."""
+        self.guard.restart()
+        try:
+            return compute()
+        except sqlite3.OperationalError as e:
+            self.guard.raise_for(e)
+            raise
+
+    def stream(self, batches):
+        """Wrap a stream_* generator: each batch gets the route's time budget and counts as query time."""
+        def guarded():
+            iterator = iter(batches)
+            while True:
+                self.guard.restart()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+                except sqlite3.OperationalError as e:
+                    self.guard.raise_for(e)
+                    raise
+                yield batch
+        return self.timer.iter_timed(guarded())
+
+    def cached(self, key, compute, size=queries.result_size):
+        """Return compute() through the shared result cache. Results above CACHE_MAX_ROWS are not stored."""
+        with self.timer.phase("query"):
+            value = self._cached(key, lambda: self.run_query(compute), size)
+        self.timer.rows += size(value)
+        return value
+
+    def _cached(self, key, compute, size):
+        if self.cache is None:
+            return compute()
+        try:
+            value = self.cache.get(key)
+        except (OSError, EOFError) as e:
+            log.warning("Cache unavailable: %s", e)
+            return compute()
+        if value is not None:
+            return value
+
+        value = compute()
+        if size(value) <= cache.CACHE_MAX_ROWS:
+            try:
+                self.cache.put(key, value)
+            except (OSError, EOFError) as e:
+                log.warning("Cache unavailable: %s", e)
+        return value
+
+    def cached_query(self, route, query_func):
+        """Wrap a list-returning queries.search_* function with the result cache."""
+        def query(*args):
+            *params, cursor = args
+            return self.cached(self.cache_key(route, params), lambda: query_func(*args))
+        return query
+
+    def send_page(self, ssl_socket, request, route, stream_func, args, cursor, keep_alive, compressor=None):
+        limit, after = request.page()
+        columnar = request.columnar
+        rows, next_token = self.cached(
+            self.cache_key(route, args + (limit, tuple(after) if after else None, columnar)),
+            lambda: queries.fetch_page(stream_func, args, cursor, limit, after, columnar),
+            size=lambda page: queries.result_size(page[0])
+        )
+        return Server.send_http_json(ssl_socket, {"results": rows, "next": next_token}, keep_alive=keep_alive,
+                                     compressor=compressor)
+
+    def send_search(self, ssl_socket, request, route, stream_func, search_func, name, cursor, keep_alive,
+                    compressor=None, scanner=None):
+        """
+        Answer a name search as a page, an NDJSON stream or the legacy progress stream, in either format.
+        scanner (a parallel.Scanner) is passed on to stream_func and search_func, which must accept it.
+        """
+        columnar = request.columnar
+        if scanner is not None:
+            stream_func = functools.partial(stream_func, scanner=scanner)
+            search_func = functools.partial(search_func, scanner=scanner)
+        self.set_route(route)
+        if request.paginated:
+            return self.send_page(ssl_socket, request, route, stream_func, (name,), cursor, keep_alive, compressor)
+        if request.wants_stream:
+            batches = self.stream(stream_func(name, cursor, columnar=columnar))
+            return Server.send_batch_stream(ssl_socket, batches, keep_alive=keep_alive, compressor=compressor)
+        query_func = self.cached_query(route + ("/columnar" if columnar else ""),
+                                       functools.partial(search_func, columnar=columnar))
+        return Server.send_streaming_response(ssl_socket, query_func, (name,), cursor, keep_alive=keep_alive,
+                                              compressor=compressor)
+
+    def send_metrics(self, ssl_socket, keep_alive, compressor=None):
+        if self.metrics is None:
+            return Server.send_http_json(ssl_socket, {"error": "Metrics are disabled"}, status="404 Not Found",
+                                         keep_alive=keep_alive, compressor=compressor)
+        cache_stats = None
+        if self.cache is not None:
+            try:
+                cache_stats = self.cache.stats()
+            except (OSError, EOFError):
+                pass
+        body = self.metrics.render(self.stats.snapshot() if self.stats else None, cache_stats,
+                                   self.admission.snapshot() if self.admission is not None else None).encode('utf-8')
+        if compressor:
+            body = compressor.body(body)
+        headers = (
+            "HTTP/1.1 200 OK\r\n"
+            f"Content-Type: {metrics.PROMETHEUS_CONTENT_TYPE}\r\n"
+            f"{compressor.header if compressor else ''}"
+            f"{Server.timing_header(ssl_socket)}"
+            f"{Server.connection_header(keep_alive)}"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n"
+        )
+        ssl_socket.sendall(headers.encode('utf-8') + body)
+        return keep_alive
+
+    def route(self, ssl_socket, request, keep_alive):
+        # Verificar se há cabeçalhos OPTIONS para pre-flight CORS
+        if request.method == "OPTIONS":
+            self.set_route("options")
+            log.debug("Recebida requisição OPTIONS (pre-flight CORS)")
+            cors_response = (
+                "HTTP/1.1 204 No Content\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+                "Access-Control-Allow-Headers: Content-Type\r\n"
+                "Access-Control-Max-Age: 86400\r\n"
+                f"{Server.timing_header(ssl_socket)}"
+                f"{Server.connection_header(keep_alive)}"
+                "\r\n"
+            )
+            ssl_socket.sendall(cors_response.encode('utf-8'))
+            return keep_alive
+
+        # Nova rota: Health check
+        if request.method == "GET" and request.path == "/health":
+            self.set_route("health")
+            response = (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/json\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Access-Control-Allow-Methods: GET, HEAD, OPTIONS\r\n"
+                f"{Server.timing_header(ssl_socket)}"
+                f"{Server.connection_header(keep_alive)}"
+                "Content-Length: 15\r\n"
+                "\r\n"
+                '{"status":"ok"}'
+            )
+            ssl_socket.sendall(response.encode('utf-8'))
+            return keep_alive
+
+        # Compressão negociada pelo Accept-Encoding (gzip/deflate)
+        compressor = Compressor(request.accept_encoding, self.stats)
+
+        # Contadores do servidor
+        if request.method == "GET" and request.path == "/stats":
+            self.set_route("stats")
+            stats = self.stats.snapshot() if self.stats else {}
+            if "response_bytes_sent" in stats:
+                stats["compression_ratio"] = round(Server.compression_ratio(stats), 2)
+            if self.admission is not None:
+                stats["admission"] = self.admission.snapshot()
+            if self.metrics:
+                workers = self.metrics.worker_connections()
+                if workers:
+                    stats["workers"] = workers
+            if self.cache is not None:
+                try:
+                    stats["cache"] = self.cache.stats()
+                except (OSError, EOFError):
+                    stats["cache"] = None
+            return Server.send_http_json(ssl_socket, stats, keep_alive=keep_alive, compressor=compressor)
+
+        # Métricas no formato do Prometheus, agregadas entre todos os processos
+        if request.method == "GET" and request.path == "/metrics":
+            self.set_route("metrics")
+            return self.send_metrics(ssl_socket, keep_alive, compressor)
+
+        # /get-person-by-name/
+        match = request.method == "GET" and re.match(r"/get-person-by-name/([^/]+)$", request.path)
+        if match:
+            name = urllib.parse.unquote_plus(match.group(1))
+            log.debug("Buscando por nome: '%s'", name)
+            return self.send_search(ssl_socket, request, "name", queries.stream_cpf_by_name, queries.search_cpf_by_name,
+                                    name, self.cursor_cpf, keep_alive, compressor, self.scanner)
+
+        # /get-person-by-exact-name/
+        match = request.method == "GET" and re.match(r"/get-person-by-exact-name/([^/]+)$", request.path)
+        if match:
+            name = urllib.parse.unquote_plus(match.group(1))
+            log.debug("Buscando por nome exato: '%s'", name)
+            return self.send_search(ssl_socket, request, "exact-name", queries.stream_cpf_by_exact_name,
+                                    queries.search_cpf_by_exact_name, name, self.cursor_cpf, keep_alive, compressor)
+
+        # /get-person-by-cpf/
+        match = request.method == "GET" and re.match(r"/get-person-by-cpf/(\d+)$", request.path)
+        if match:
+            cpf = match.group(1)
+            columnar = request.columnar
+            self.set_route("cpf")
+            if self.cpf_index is not None and cpf_index.cpf_key(cpf) is not None:
+                # A binary search over the mapped index is cheaper than a trip to the cache process
+                with self.timer.phase("query"):
+                    result = self.cpf_index.search(cpf, columnar)
+                self.timer.rows += queries.result_size(result)
+            else:
+                result = self.cached(("cpf", cpf, columnar),
+                                     lambda: queries.search_cpf_by_cpf(cpf, self.cursor_cpf, columnar))
+            return Server.send_http_json(ssl_socket, {"results": result}, keep_alive=keep_alive, compressor=compressor)
+
+        # /get-persons-by-cpf: CPFs no corpo, resultados em lotes na ordem de entrada
+        if request.method == "POST" and request.path == "/get-persons-by-cpf":
+            self.set_route("batch-cpf")
+            cpfs = request.cpf_list()
+            log.debug("Buscando %d CPFs em lote", len(cpfs))
+            return Server.send_batch_stream(ssl_socket,
+                                            self.stream(queries.stream_cpfs_by_cpf(cpfs, self.cursor_cpf)),
+                                            keep_alive=keep_alive, compressor=compressor)
+
+        # /get-person-cnpj-by-name/
+        match = request.method == "GET" and re.match(r"/get-person-cnpj-by-name/([^/]+)$", request.path)
+        if match:
+            name = urllib.parse.unquote_plus(match.group(1))
+            log.debug("Buscando sócio por nome: '%s'", name)
+            return self.send_search(ssl_socket, request, "cnpj-name", queries.stream_person_cnpj,
+                                    queries.check_person_cnpj, name, self.cursor_cnpj, keep_alive, compressor,
+                                    self.scanner)
+
+        # /get-person-cnpj-by-name-cpf/ (nome exato) e /get-person-cnpj-by-name-cpf-radical/ (com estabelecimentos)
+        match = request.method == "GET" and re.match(r"/get-person-cnpj-by-name-cpf(-radical)?/([^/]+?)-([\d.\-]+)$",
+                                                     request.path)
+        if match:
+            radical = match.group(1) is not None
+            route = "cnpj-radical" if radical else "cnpj-name-cpf"
+            self.set_route(route)
+            name, cpf = self.partner_params(match.group(2), match.group(3))
+            log.debug("Buscando empresas do sócio: '%s' (%s)", name, cpf)
+            options = {"exact": not radical, "establishments": radical}
+            if request.wants_stream:
+                return Server.send_batch_stream(
+                    ssl_socket, self.stream(queries.stream_partner_companies(name, cpf, self.cursor_cnpj, **options)),
+                    keep_alive=keep_alive, compressor=compressor
+                )
+            result = self.cached(self.cache_key(route, (name, cpf)),
+                                 lambda: queries.search_partner_companies(name, cpf, self.cursor_cnpj, **options))
+            return Server.send_http_json(ssl_socket, {"results": result}, keep_alive=keep_alive, compressor=compressor)
+
+        # Invalid request
+        return Server.send_http_json(ssl_socket, {"error": "Invalid request"}, status="400 Bad Request",
+                                     keep_alive=keep_alive, compressor=compressor)
+
 class Server():
-    def __init__(self, host, port, cpf_db, cnpj_db, semaphore):
+    # "process": one process per accepted connection
+    # "prefork": a fixed pool of long-lived worker processes
+    # "reuseport": like prefork, but each worker binds its own socket with SO_REUSEPORT
+    #              and the kernel spreads the connections among them
+    MODES = ("process", "prefork", "reuseport")
+    # Modes served by a pool of self.workers supervised processes
+    POOL_MODES = ("prefork", "reuseport")
+
+    STATS = ("tls_handshakes_full", "tls_handshakes_resumed",
+             # Response body bytes before and after Content-Encoding
+             "response_bytes_raw", "response_bytes_sent",
+             # Process mode: connections answered 503 by the accept process, or closed unanswered
+             "connections_shed", "connections_dropped")
+
+    def __init__(self, host, port, cpf_db, cnpj_db, semaphore, mode="process", workers=None,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, max_requests=MAX_KEEPALIVE_REQUESTS,
+                 cache_size=cache.DEFAULT_CACHE_SIZE, cache_ttl=cache.DEFAULT_CACHE_TTL, db_options=None,
+                 cpf_index_path=None, log_options=None, profile_options=None, query_timeout=None,
+                 admission_options=None, report_interval=None, scan_partitions=None, scan_threads=False):
         super().__init__()
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid server mode: {mode}")
+        if mode == "reuseport" and not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("The reuseport mode needs SO_REUSEPORT, which this platform does not have")
         self.host = host
         self.port = port
         self.cpf_db = cpf_db
@@ -21,6 +872,42 @@ class Server():
         self.server = None
         self.running = False
         self.semaphore = semaphore
+        self.mode = mode
+        self.workers = workers or multiprocessing.cpu_count()
+        self.worker_processes = []
+        self.keepalive_timeout = keepalive_timeout
+        self.max_requests = max_requests
+        self.ssl_context = None
+        self.stats = metrics.SharedCounters(self.STATS)
+        self.metrics = metrics.ServerMetrics(self.workers)
+        # Shared result cache (0 disables it)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache_manager = None
+        self.cache = None
+        self.db_options = db_options or {}
+        self.cpf_index_path = cpf_index_path
+        # Seconds allowed per query on every route; None uses QUERY_TIMEOUTS, 0 disables the limit
+        self.query_timeout = query_timeout
+        # Slots per request class, shared by every process (keyword arguments for admission.AdmissionControl)
+        self.admission = admission.AdmissionControl(self.workers, **(admission_options or {}))
+        self.shed_executor = None
+        # Connections queued for a 503: taken in the accept loop, given back by the shed threads
+        self.shed_pending = threading.BoundedSemaphore(MAX_SHED_PENDING)
+        # Process mode: {sentinel: (process, holder)} of the connection processes, and the holders not in use
+        self.children = {}
+        self.free_holders = list(range(self.workers))
+        # Keyword arguments for logs.start (level, fmt, sample_rate)
+        self.log_options = log_options or {}
+        # Keyword arguments for profiling.RequestProfiler; None disables profiling
+        self.profiler = profiling.RequestProfiler(**profile_options) if profile_options is not None else None
+        # Rowid ranges the full-scan searches are split into (parallel.Scanner); None or 1 scans serially
+        self.scan_partitions = scan_partitions
+        # The process, prefork and reuseport workers are daemonic and can only scan with threads, which never
+        # beat a serial scan in benchmark.py scan (see the README); they split scans only if this is set
+        self.scan_threads = scan_threads
+        # Seconds between log lines with the connections of each worker process (pool modes); None disables them
+        self.report_interval = report_interval
         self.start_time = None
         self.stop_time = None
 
@@ -36,25 +923,61 @@ class Server():
             s.close()
 
     @staticmethod
-    def send_http_json(conn, data):
+    def create_ssl_context():
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile="cert.pem", keyfile="key.pem")
+        # Session tickets let repeat clients resume instead of doing a full handshake.
+        # The ticket keys belong to this context, so every process forked after it
+        # was created can resume sessions issued by any other process.
+        context.options &= ~ssl.OP_NO_TICKET
+        context.num_tickets = 2
+        return context
+
+    @staticmethod
+    def compression_ratio(counts):
+        # Raw bytes per byte sent: 1.0 when nothing was compressed
+        return counts["response_bytes_raw"] / counts["response_bytes_sent"] if counts["response_bytes_sent"] else 1.0
+
+    @staticmethod
+    def connection_header(keep_alive):
+        return f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+
+    @staticmethod
+    def timing_header(sock):
+        # sock is the Worker's metrics.MeteredSocket, which carries the request's phase timers
+        timer = getattr(sock, "timer", None)
+        if timer is None:
+            return ""
+        return f"Server-Timing: {timer.server_timing()}\r\nTiming-Allow-Origin: *\r\n"
+
+    @staticmethod
+    def timing_trailer_header(sock):
+        return "Trailer: Server-Timing\r\nTiming-Allow-Origin: *\r\n" if getattr(sock, "timer", None) else ""
+
+    @staticmethod
+    def send_http_json(conn, data, status="200 OK", keep_alive=False, compressor=None, extra_headers=""):
         try:
             # Convertendo para JSON com tamanho limitado de dados
-            body = json.dumps(data, ensure_ascii=False)
-            print(f"Enviando resposta com {len(body)} bytes")
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            if compressor:
+                body = compressor.body(body)
 
             # Preparar o cabeçalho HTTP
-            response = (
-              "HTTP/1.1 200 OK\r\n"
+            headers = (
+              f"HTTP/1.1 {status}\r\n"
               "Content-Type: application/json; charset=utf-8\r\n"
               "Access-Control-Allow-Origin: *\r\n"  # Permitir qualquer origem
               "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
-              f"Content-Length: {len(body.encode('utf-8'))}\r\n"
+              f"{compressor.header if compressor else ''}"
+              f"{Server.timing_header(conn)}"
+              f"{extra_headers}"
+              f"{Server.connection_header(keep_alive)}"
+              f"Content-Length: {len(body)}\r\n"
               "\r\n"
-              f"{body}"
             )
 
             # Converter para bytes
-            response_bytes = response.encode('utf-8')
+            response_bytes = headers.encode('utf-8') + body
 
             # Enviar em pedaços de 8192 bytes para evitar problemas com pacotes muito grandes
             total_sent = 0
@@ -65,14 +988,138 @@ class Server():
                     raise RuntimeError("Socket connection broken")
                 total_sent += sent
 
-            print(f"Resposta enviada com sucesso: {total_sent} bytes")
+            log.debug("Resposta enviada com sucesso: %d bytes", total_sent)
+            return keep_alive
 
         except Exception as e:
-            print(f"Erro ao enviar resposta: {e}")
-            traceback.print_exc()
+            log.exception("Erro ao enviar resposta: %s", e)
+            return False
+
+    @staticmethod
+    def send_chunk(sock, payload, compressor=None):
+        if compressor:
+            payload = compressor.chunk(payload)
+        if payload:
+            sock.sendall(f"{len(payload):X}\r\n".encode('ascii') + payload + b"\r\n")
+
+    @staticmethod
+    def send_last_chunk(sock, compressor=None):
+        tail = compressor.finish() if compressor else b""
+        if tail:
+            Server.send_chunk(sock, tail)
+        # The full phase timings are only known at the end, so streams carry them in a trailer
+        timer = getattr(sock, "timer", None)
+        trailer = f"Server-Timing: {timer.server_timing()}\r\n" if timer else ""
+        sock.sendall(f"0\r\n{trailer}\r\n".encode('ascii'))
+
+    @staticmethod
+    def send_unavailable(conn, overloaded):
+        return Server.send_http_json(conn, {"error": str(overloaded), "retryAfter": overloaded.retry_after},
+                                     status="503 Service Unavailable",
+                                     extra_headers=f"Retry-After: {overloaded.retry_after}\r\n")
+
+    @staticmethod
+    def reject_connection(client_socket, addr, context, retry_after):
+        """Answer 503 on a connection no worker could take: handshake, read one request, reply and close."""
+        ssl_socket = None
+        try:
+            client_socket.settimeout(SHED_TIMEOUT)
+            ssl_socket = context.wrap_socket(client_socket, server_side=True)
+            Worker.read_request(ssl_socket, bytearray())
+            Server.send_unavailable(ssl_socket, admission.Overloaded("connection", retry_after))
+        except (OSError, BadRequest) as e:
+            log.debug("Could not answer 503 to %s: %s", addr, e)
+        finally:
+            for sock in (ssl_socket, client_socket):
+                if sock:
+                    try:
+                        sock.close()
+                    except OSError:
+                        pass
+
+    @staticmethod
+    def stream_error(e, **fields):
+        """Log what interrupted a streamed response and build the last message sent to the client."""
+        message = {"status": "error", "message": str(e), **fields, "isComplete": True}
+        if isinstance(e, db.QueryTimeout):
+            log.warning("Resposta streaming interrompida: %s", e)
+            message["timeout"] = e.timeout
+        else:
+            log.exception("Erro ao enviar resposta streaming: %s", e)
+        return json.dumps(message)
+
+    @staticmethod
+    def peer_closed(sock):
+        """True if the client has closed its side of sock, checked without reading from it."""
+        check = getattr(sock, "peer_closed", None)
+        if check is not None:
+            # async_server.StreamSink
+            return check()
+        if not hasattr(select, "POLLRDHUP"):
+            # Only Linux reports a peer shutdown without a read; elsewhere only the time budget applies
+            return False
+        try:
+            fd = sock.fileno()
+        except OSError:
+            return True
+        if fd < 0:
+            return True
+        poller = select.poll()
+        poller.register(fd, select.POLLRDHUP | select.POLLHUP | select.POLLERR)
+        return bool(poller.poll(0))
 
     @staticmethod
-    def send_streaming_response(ssl_socket, query_func, params, cursor):
+    def send_batch_stream(ssl_socket, batches, keep_alive=False, compressor=None):
+        """
+        Envia os resultados em NDJSON, um chunk por lote lido do cursor. A memória
+        usada por requisição fica limitada ao tamanho do lote, não ao do resultado.
+        """
+        rows_sent = 0
+        try:
+            headers = (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/x-ndjson; charset=utf-8\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+                f"{compressor.header if compressor else ''}"
+                "Transfer-Encoding: chunked\r\n"
+                f"{Server.timing_trailer_header(ssl_socket)}"
+                f"{Server.connection_header(keep_alive)}"
+                "\r\n"
+            )
+            ssl_socket.sendall(headers.encode('utf-8'))
+
+            for batch in batches:
+                rows_sent += len(batch)
+                message = json.dumps({
+                    "status": "streaming",
+                    "rows": rows_sent,
+                    "isComplete": False,
+                    "results": batch.to_json() if isinstance(batch, queries.RowBatch) else batch
+                }, ensure_ascii=False)
+                Server.send_chunk(ssl_socket, (message + "\n").encode('utf-8'), compressor)
+
+            final_message = json.dumps({"status": "complete", "rows": rows_sent, "isComplete": True})
+            Server.send_chunk(ssl_socket, (final_message + "\n").encode('utf-8'), compressor)
+            Server.send_last_chunk(ssl_socket, compressor)
+            log.debug("Resposta streaming concluída com %d resultados", rows_sent)
+            return keep_alive
+
+        except db.ClientDisconnected as e:
+            log.info("Resposta streaming cancelada: %s", e)
+            return False
+        except Exception as e:
+            # Tenta enviar mensagem de erro em caso de falha
+            try:
+                error_msg = Server.stream_error(e, rows=rows_sent)
+                Server.send_chunk(ssl_socket, (error_msg + "\n").encode('utf-8'), compressor)
+                Server.send_last_chunk(ssl_socket, compressor)
+            except:
+                pass
+            return False
+
+    @staticmethod
+    def send_streaming_response(ssl_socket, query_func, params, cursor, keep_alive=False, compressor=None):
         try:
             # Enviar cabeçalhos iniciais
             headers = (
@@ -80,8 +1127,10 @@ class Server():
                 "Content-Type: application/json; charset=utf-8\r\n"
                 "Access-Control-Allow-Origin: *\r\n"
                 "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+                f"{compressor.header if compressor else ''}"
                 "Transfer-Encoding: chunked\r\n"
-                "Connection: keep-alive\r\n"
+                f"{Server.timing_trailer_header(ssl_socket)}"
+                f"{Server.connection_header(keep_alive)}"
                 "\r\n"
             )
             ssl_socket.sendall(headers.encode('utf-8'))
@@ -93,25 +1142,18 @@ class Server():
                 "progress": 0,
                 "isComplete": False
             })
-            chunk = f"{len(initial_update):X}\r\n{initial_update}\r\n"
-            ssl_socket.sendall(chunk.encode('utf-8'))
+            Server.send_chunk(ssl_socket, initial_update.encode('utf-8'), compressor)
 
             # Enviar atualização de 25%
-            ssl_socket.sendall(
-                f"{len(json.dumps({'status': 'searching', 'progress': 25, 'isComplete': False})):X}\r\n".encode('utf-8') +
-                json.dumps({'status': 'searching', 'progress': 25, 'isComplete': False}).encode('utf-8') +
-                "\r\n".encode('utf-8')
-            )
+            Server.send_chunk(ssl_socket, json.dumps({'status': 'searching', 'progress': 25, 'isComplete': False})
+                              .encode('utf-8'), compressor)
 
             # Executar a consulta
             result = query_func(*params, cursor)
 
             # Enviar atualização de 75%
-            ssl_socket.sendall(
-                f"{len(json.dumps({'status': 'processing', 'progress': 75, 'isComplete': False})):X}\r\n".encode('utf-8') +
-                json.dumps({'status': 'processing', 'progress': 75, 'isComplete': False}).encode('utf-8') +
-                "\r\n".encode('utf-8')
-            )
+            Server.send_chunk(ssl_socket, json.dumps({'status': 'processing', 'progress': 75, 'isComplete': False})
+                              .encode('utf-8'), compressor)
 
             # Preparar e enviar o resultado final
             final_result = json.dumps({
@@ -120,164 +1162,122 @@ class Server():
                 "isComplete": True,
                 "results": result
             })
-            chunk = f"{len(final_result):X}\r\n{final_result}\r\n"
-            ssl_socket.sendall(chunk.encode('utf-8'))
+            Server.send_chunk(ssl_socket, final_result.encode('utf-8'), compressor)
 
             # Terminar a resposta chunked
-            ssl_socket.sendall("0\r\n\r\n".encode('utf-8'))
-            print(f"Resposta streaming concluída com {len(result)} resultados")
+            Server.send_last_chunk(ssl_socket, compressor)
+            log.debug("Resposta streaming concluída com %d resultados", queries.result_size(result))
+            return keep_alive
 
+        except db.ClientDisconnected as e:
+            log.info("Resposta streaming cancelada: %s", e)
+            return False
         except Exception as e:
-            print(f"Erro ao enviar resposta streaming: {e}")
-            traceback.print_exc()
-
             # Tenta enviar mensagem de erro em caso de falha
             try:
-                error_msg = json.dumps({"status": "error", "message": str(e), "isComplete": True})
-                chunk = f"{len(error_msg):X}\r\n{error_msg}\r\n0\r\n\r\n"
-                ssl_socket.sendall(chunk.encode('utf-8'))
+                error_msg = Server.stream_error(e)
+                Server.send_chunk(ssl_socket, error_msg.encode('utf-8'), compressor)
+                Server.send_last_chunk(ssl_socket, compressor)
             except:
                 pass
+            return False
 
-    @staticmethod
-    def handle_client(client_socket, addr, cpf_db, cnpj_db, semaphore):
-        ssl_socket = None
-        conn_cpf = None
-        conn_cnpj = None
+    def create_worker(self):
+        # Worker processes are forked, so the shared context and counters are inherited as-is
+        return Worker(self.cpf_db, self.cnpj_db, self.ssl_context, self.stats,
+                      self.keepalive_timeout, self.max_requests, self.cache, self.db_options,
+                      self.cpf_index_path, self.metrics, self.profiler, self.query_timeout, self.admission,
+                      self.scan_partitions if self.mode == "asyncio" or self.scan_threads else None)
 
-        try:
-            # Wrap the socket with SSL
-            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-            context.load_cert_chain(certfile="cert.pem", keyfile="key.pem")
+    def _start_cache(self):
+        if self.cache_size > 0:
+            self.cache_manager, self.cache = cache.start_cache(
+                [self.cpf_db, self.cnpj_db], self.cache_size, self.cache_ttl
+            )
+            log.info("Result cache: %d entries, TTL %ss", self.cache_size, self.cache_ttl)
 
+    def _stop_cache(self):
+        if self.cache_manager:
             try:
-                ssl_socket = context.wrap_socket(client_socket, server_side=True)
-                print(f"SSL handshake successful with {addr}")
-            except ssl.SSLError as e:
-                print(f"SSL handshake failed with {addr}: {e}")
-                return
-            except Exception as e:
-                print(f"Error during SSL wrap: {e}")
-                return
-
-            # Open database connections
-            conn_cpf = sqlite3.connect(cpf_db)
-            conn_cnpj = sqlite3.connect(cnpj_db)
-            cursor_cpf = conn_cpf.cursor()
-            cursor_cnpj = conn_cnpj.cursor()
-
-            # Receive data from client
-            data = ssl_socket.recv(1024)
-            if not data:
-                print(f"No data received from {addr}")
-                return
-
-            request = data.decode()
-            print(f"Request from {addr}: {request.splitlines()[0] if request else 'Empty'}")
-
-            # Verificar se há cabeçalhos OPTIONS para pre-flight CORS
-            if request.startswith("OPTIONS"):
-                print("Recebida requisição OPTIONS (pre-flight CORS)")
-                cors_response = (
-                    "HTTP/1.1 204 No Content\r\n"
-                    "Access-Control-Allow-Origin: *\r\n"
-                    "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
-                    "Access-Control-Allow-Headers: Content-Type\r\n"
-                    "Access-Control-Max-Age: 86400\r\n"
-                    "\r\n"
-                )
-                ssl_socket.sendall(cors_response.encode('utf-8'))
-                return
-
-            # Nova rota: Health check
-            if "GET /health" in request:
-                print("Recebida solicitação de health check")
-                response = (
-                    "HTTP/1.1 200 OK\r\n"
-                    "Content-Type: application/json\r\n"
-                    "Access-Control-Allow-Origin: *\r\n"
-                    "Access-Control-Allow-Methods: GET, HEAD, OPTIONS\r\n"
-                    "Connection: close\r\n"
-                    "Content-Length: 15\r\n"
-                    "\r\n"
-                    '{"status":"ok"}'
-                )
-                print("Enviando resposta health check:", response.replace('\r\n', '\\r\\n'))
-                ssl_socket.sendall(response.encode('utf-8'))
-                return
-
-            # /get-person-by-name/
-            match = re.match(r"GET /get-person-by-name/([^ ]+) HTTP/1.[01]", request)
-            if match:
-                name = urllib.parse.unquote_plus(match.group(1))
-                print(f"Buscando por nome: '{name}'")
-                Server.send_streaming_response(ssl_socket, queries.search_cpf_by_name, (name,), cursor_cpf)
-                return
-
-            # /get-person-by-exact-name/
-            match = re.match(r"GET /get-person-by-exact-name/([^ ]+) HTTP/1.[01]", request)
-            if match:
-                name = urllib.parse.unquote_plus(match.group(1))
-                print(f"Buscando por nome exato: '{name}'")
-                Server.send_streaming_response(ssl_socket, queries.search_cpf_by_exact_name, (name,), cursor_cpf)
-                return
-
-            # /get-person-by-cpf/
-            match = re.match(r"GET /get-person-by-cpf/(\d+) HTTP/1.[01]", request)
-            if match:
-                cpf = match.group(1)
-                result = queries.search_cpf_by_cpf(cpf, cursor_cpf)
-                Server.send_http_json(ssl_socket, {"results": result})
-                return
+                log.info("Cache: %s", self.cache.stats())
+            except (OSError, EOFError):
+                pass
+            self.cache_manager.shutdown()
+        self.cache_manager = None
+        self.cache = None
 
-            # Invalid request
-            error_body = json.dumps({"error": "Invalid request"})
-            response = (
-                "HTTP/1.1 400 Bad Request\r\n"
-                "Content-Type: application/json\r\n"
-                f"Content-Length: {len(error_body)}\r\n"
-                "\r\n"
-                f"{error_body}"
-            )
-            ssl_socket.sendall(response.encode("utf-8"))
-        except Exception as e:
-            print(f"Error handling client {addr}: {e}")
-            traceback.print_exc()
+    @staticmethod
+    def handle_client(client_socket, addr, worker, accepted_at=None):
+        # The accept process releases the semaphore once this process is gone, even if it is killed
+        if accepted_at is not None and worker.metrics:
+            # Time spent waiting for the semaphore and for this process to start
+            worker.metrics.observe_wait(time.monotonic() - accepted_at)
+        try:
+            worker.handle_connection(client_socket, addr)
         finally:
-            if semaphore:
-                semaphore.release()
-
-            # Close database connections
-            if conn_cpf:
-                try:
-                    conn_cpf.close()
-                except:
-                    pass
-            if conn_cnpj:
-                try:
-                    conn_cnpj.close()
-                except:
-                    pass
+            worker.close()
 
-            # Close sockets
-            if ssl_socket:
-                try:
-                    ssl_socket.close()
-                except:
-                    pass
+    @staticmethod
+    def listen_socket(host, port, reuse_port=False):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind((host, port))
+        return server_socket
 
-            try:
-                client_socket.close()
-            except:
-                pass
+    @staticmethod
+    def run_acceptor(host, port, worker):
+        # reuseport worker: its own listening socket on the shared port, so the kernel
+        # balances new connections across workers instead of waking them all on one queue
+        server_socket = Server.listen_socket(host, port, reuse_port=True)
+        server_socket.listen(4096)
+        if worker.metrics:
+            worker.metrics.listen_socket = server_socket
+        worker.listen_shared = False
+        Server.run_worker(server_socket, worker)
 
-            print(f"Connection with {addr} closed")
+    @staticmethod
+    def run_worker(server_socket, worker):
+        # Long-lived worker: the database connections are opened once
+        # and reused for every connection accepted here
+        try:
+            if worker.metrics and worker.slot is not None:
+                worker.metrics.worker_started(worker.slot, multiprocessing.current_process().pid)
+            worker.open()
+            worker.listen_socket = server_socket
+            log.info("Worker %d ready", multiprocessing.current_process().pid)
+            while True:
+                if worker.admission is not None:
+                    worker.admission.set_state(worker.holder, admission.ACCEPTING)
+                try:
+                    client_socket, addr = server_socket.accept()
+                except OSError as e:
+                    if e.errno == 9:  # Bad file descriptor
+                        break
+                    log.error("Error accepting connection: %s", e)
+                    continue
+                log.debug("New connection from %s", addr)
+                if worker.admission is not None:
+                    worker.admission.set_state(worker.holder, admission.ACTIVE)
+                client_socket.settimeout(5.0)
+                worker.handle_connection(client_socket, addr)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.close()
 
     def start(self):
+        # The log listener must exist before any worker process is forked
+        logs.start(**self.log_options)
+        if self.scan_partitions and self.scan_partitions > 1 and not self.scan_threads:
+            log.warning("Parallel scans are off in the %s engine: its workers would scan with threads, which were "
+                        "slower than a serial scan in benchmarks (--scan-threads enables them)", self.mode)
+
         # Registrar o tempo de início
         self.start_time = time.time()
         start_datetime = datetime.fromtimestamp(self.start_time)
-        print(f"[SERVER] Starting at: {start_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+        log.info("Starting at: %s", start_datetime.strftime('%Y-%m-%d %H:%M:%S'))
         
         # Server configuration
         HOST = self.host
@@ -285,72 +1285,197 @@ class Server():
 
         # Create socket
         try:
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_socket.bind((HOST, PORT))
-            server_socket.listen(4096)
+            # Load the certificate once; every handler shares this context
+            self.ssl_context = self.create_ssl_context()
+            self._start_cache()
+
+            if self.mode == "reuseport":
+                # Bound but never listening: reserves the port and fails here if it is taken,
+                # while the kernel only hands connections to the workers' listening sockets
+                server_socket = self.listen_socket(HOST, PORT, reuse_port=True)
+            else:
+                server_socket = self.listen_socket(HOST, PORT)
+                server_socket.listen(4096)
+                self.metrics.listen_socket = server_socket
 
             self.server = server_socket
 
             local_ip = self.get_local_ip()
-            print(f"[SERVER] Listening on {local_ip}:{PORT} (HTTPS)")
+            log.info("Listening on %s:%s (HTTPS)", local_ip, PORT)
 
             # Start server
             self.running = True
 
+            if self.mode in self.POOL_MODES:
+                self._run_pool()
+                return
+
             while self.running:
                 try:
-                    # Use select with a timeout to make the server interruptible
-                    ready_to_read, _, _ = select.select([self.server], [], [], 1.0)
+                    # Wait for a connection or for a connection process to end, with a
+                    # timeout to make the server interruptible
+                    ready = multiprocessing.connection.wait([self.server] + list(self.children), 1.0)
+                    self._reap_children()
 
-                    if not ready_to_read:
+                    if self.server not in ready:
                         continue
 
                     # Accept connection
                     client_socket, addr = self.server.accept()
-                    print(f"[CONNECTION] New connection from {addr}")
+                    accepted_at = time.monotonic()
+                    log.debug("New connection from %s", addr)
 
-                    # Acquire semaphore to limit simultaneous connections
-                    self.semaphore.acquire()
+                    # Every slot taken: close an idle keep-alive connection to make room, or
+                    # answer 503 instead of blocking the accept loop
+                    if not self._take_slot() and not self._reclaim_idle():
+                        self._shed(client_socket, addr)
+                        continue
 
                     # Set a reasonable timeout
                     client_socket.settimeout(5.0)
 
                     # Create a process to handle the client and pass the whole socket to the new process
+                    worker = self.create_worker()
+                    worker.holder = self.free_holders.pop()
                     process = multiprocessing.Process(
                         target=self.handle_client,
-                        args=(client_socket, addr, self.cpf_db, self.cnpj_db, self.semaphore)
+                        args=(client_socket, addr, worker, accepted_at)
                     )
                     process.daemon = True
                     process.start()
-                    client_socket.detach()
+                    # The child has its own copy; keeping this one open would leak a descriptor per
+                    # connection and keep the connection up if the child is killed
+                    client_socket.close()
+                    self.children[process.sentinel] = (process, worker.holder)
 
-                except OSError as e:
-                    if e.errno == 9:  # Bad file descriptor
-                        print(f"Error accepting connection: socket may have been closed")
+                except (OSError, ValueError) as e:
+                    if not self.running:
+                        break
+                    if getattr(e, "errno", None) == 9:  # Bad file descriptor
+                        log.error("Error accepting connection: socket may have been closed")
                     else:
-                        print(f"Error accepting connection: {e}")
-                        traceback.print_exc()
+                        log.exception("Error accepting connection: %s", e)
                 except Exception as e:
-                    print(f"Unexpected error in server loop: {e}")
-                    traceback.print_exc()
+                    log.exception("Unexpected error in server loop: %s", e)
 
         except Exception as e:
-            print(f"Error setting up server: {e}")
-            traceback.print_exc()
+            log.exception("Error setting up server: %s", e)
             # Registrar tempo de parada mesmo em caso de erro
             self.stop_time = time.time()
             self._log_execution_time()
 
+    def _reap_children(self):
+        """Process mode: give back the slot of every connection process that has ended, however it ended."""
+        for sentinel, (process, holder) in list(self.children.items()):
+            if process.is_alive():
+                continue
+            del self.children[sentinel]
+            if process.exitcode:
+                log.warning("Connection process %d exited with code %s", process.pid, process.exitcode)
+            self._holder_gone(holder)
+            self.free_holders.append(holder)
+            self.semaphore.release()
+
+    def _take_slot(self):
+        return bool(self.free_holders) and self.semaphore.acquire(False)
+
+    def _reclaim_idle(self):
+        """Process mode: ask an idle keep-alive connection to close and take its slot. True if it did."""
+        holder = self.admission.reclaim_idle()
+        if holder is None:
+            return False
+        for process, child_holder in list(self.children.values()):
+            if child_holder == holder:
+                # join, not the sentinel alone: the sentinel is ready a moment before the process can be reaped
+                process.join(IDLE_RECLAIM_TIMEOUT)
+        self._reap_children()
+        return self._take_slot()
+
+    def _holder_gone(self, holder):
+        # A process that died mid-request never released its admission slot nor undid its gauges
+        if self.admission.release_holder(holder):
+            log.warning("Released the admission slot held by dead worker %d", holder)
+        self.metrics.holder_gone(holder)
+
+    def _shed(self, client_socket, addr):
+        if self.shed_executor is None:
+            self.shed_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SHED_THREADS)
+        if not self.shed_pending.acquire(blocking=False):
+            self.stats.increment("connections_dropped")
+            client_socket.close()
+            return
+        self.stats.increment("connections_shed")
+        future = self.shed_executor.submit(self.reject_connection, client_socket, addr, self.ssl_context,
+                                           self.admission.retry_after)
+        future.add_done_callback(self._shed_done)
+
+    def _shed_done(self, future):
+        self.shed_pending.release()
+
+    def _spawn_worker(self, slot):
+        worker = self.create_worker()
+        worker.slot = worker.holder = slot
+        if self.mode == "reuseport":
+            target, args = self.run_acceptor, (self.host, self.port, worker)
+        else:
+            # The listening socket is inherited by the worker, which accepts on it directly
+            target, args = self.run_worker, (self.server, worker)
+        process = multiprocessing.Process(target=target, args=args)
+        process.daemon = True
+        process.start()
+        return process
+
+    def _run_pool(self):
+        log.info("Starting %d %s workers", self.workers, "SO_REUSEPORT" if self.mode == "reuseport" else "pre-forked")
+        self.worker_processes = [self._spawn_worker(slot) for slot in range(self.workers)]
+
+        # Supervise the pool, respawning workers that die
+        last_report = time.monotonic()
+        while self.running:
+            multiprocessing.connection.wait([p.sentinel for p in self.worker_processes], timeout=1.0)
+            respawned = False
+            for i, process in enumerate(self.worker_processes):
+                if process.is_alive() or not self.running:
+                    continue
+                log.warning("Worker %d exited with code %s, respawning", process.pid, process.exitcode)
+                self._holder_gone(i)
+                self.worker_processes[i] = self._spawn_worker(i)
+                respawned = True
+            if self.report_interval and time.monotonic() - last_report >= self.report_interval:
+                self._log_worker_connections()
+                last_report = time.monotonic()
+            if respawned:
+                # Avoid a tight respawn loop if workers die right after starting
+                time.sleep(0.5)
+
+    def _log_worker_connections(self):
+        workers = self.metrics.worker_connections()
+        if workers:
+            log.info("Connections per worker (accepted/open): %s",
+                     ", ".join(f"{w['pid']}: {w['accepted']}/{w['open']}" for w in workers))
+
     def stop(self):
         self.running = False
         if self.server:
             self.server.close()
+
+        # Terminate pre-forked workers
+        for process in self.worker_processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.worker_processes:
+            process.join(timeout=5)
+        self.worker_processes = []
+        if self.shed_executor:
+            self.shed_executor.shutdown(wait=False, cancel_futures=True)
+            self.shed_executor = None
+        parallel.shutdown()
+        self._stop_cache()
         
         # Registrar o tempo de parada
         self.stop_time = time.time()
         stop_datetime = datetime.fromtimestamp(self.stop_time)
-        print(f"[SERVER] Stopped at: {stop_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+        log.info("Stopped at: %s", stop_datetime.strftime('%Y-%m-%d %H:%M:%S'))
         
         # Calcular e exibir o tempo total de execução
         self._log_execution_time()
@@ -364,7 +1489,13 @@ class Server():
             
             duration = timedelta(seconds=execution_time)
             
-            print(f"[SERVER] Total execution time: {int(hours)}h {int(minutes)}m {int(seconds)}s ({execution_time:.2f} seconds)")
-            print(f"[SERVER] Server was active for: {duration}")
+            log.info("Total execution time: %dh %dm %ds (%.2f seconds)", hours, minutes, seconds, execution_time)
+            log.info("Server was active for: %s", duration)
+            counts = self.stats.snapshot()
+            log.info("TLS handshakes: %d full, %d resumed", counts['tls_handshakes_full'],
+                     counts['tls_handshakes_resumed'])
+            log.info("Response bodies: %d bytes, %d sent (compression ratio %.2f)", counts['response_bytes_raw'],
+                     counts['response_bytes_sent'], Server.compression_ratio(counts))
+            self._log_worker_connections()
         else:
-            print("[SERVER] Execution time could not be calculated (missing start or stop time)")
+            log.warning("Execution time could not be calculated (missing start or stop time)")